@@ -3,9 +3,12 @@
 https://www.waveshare.com/pico-lcd-1.14.htm
 """
 
-from machine import Pin, SPI, PWM
-from framebuf import FrameBuffer, RGB565
+import micropython
+from machine import Pin, SPI, PWM, mem32, disable_irq, enable_irq
+from framebuf import FrameBuffer, RGB565, GS8
 from micropython import const
+from utime import ticks_us, ticks_diff
+from array import array
 
 
 _BL = const(13)
@@ -19,6 +22,14 @@ _CS = const(9)
 LCD_W = const(240)
 LCD_H = const(135)
 
+# LCD上の表示位置
+_OFFSET_X = const(40)
+_OFFSET_Y = const(53)
+
+# 変換して転送する行数（インデックスカラー・RGB444）
+_CHUNK_LINES = const(8)
+_CHUNK_PIXELS = const(LCD_W * _CHUNK_LINES)
+
 # キー入力
 KEY_UP = const(0b0000_1000)
 KEY_DOWN = const(0b0000_0100)
@@ -28,15 +39,52 @@ KEY_A = const(0b0010_0000)
 KEY_B = const(0b0001_0000)
 KEY_CENTER = const(0b1000_0000)
 
+# キーのピン番号
+_PIN_A = const(15)
+_PIN_B = const(17)
+_PIN_UP = const(2)
+_PIN_CENTER = const(3)
+_PIN_LEFT = const(16)
+_PIN_DOWN = const(18)
+_PIN_RIGHT = const(20)
+# ピン番号, キー
+key_pins = const(
+    (
+        (_PIN_A, KEY_A),
+        (_PIN_B, KEY_B),
+        (_PIN_UP, KEY_UP),
+        (_PIN_CENTER, KEY_CENTER),
+        (_PIN_LEFT, KEY_LEFT),
+        (_PIN_DOWN, KEY_DOWN),
+        (_PIN_RIGHT, KEY_RIGHT),
+    )
+)
+_KEY_PIN_MASK = const(
+    (1 << _PIN_A)
+    | (1 << _PIN_B)
+    | (1 << _PIN_UP)
+    | (1 << _PIN_CENTER)
+    | (1 << _PIN_LEFT)
+    | (1 << _PIN_DOWN)
+    | (1 << _PIN_RIGHT)
+)
+_SIO_GPIO_IN = const(0xD0000004)  # RP2040 GPIO入力レジスタ
+_DEBOUNCE_US = const(5000)  # 前のエッジからこれより短いエッジはチャタリング
+
 LCD_BRIGHTNESS_MAX = const(5)
 # LCDの明るさ
 brightness_table = const((4095, 8191, 16383, 32767, 65535))
 
 
 class LCD114(FrameBuffer):
-    """ 1.14inch LCD の画面表示制御"""
+    """ 1.14inch LCD の画面表示制御
 
-    def __init__(self):
+    Params:
+        rgb444 (bool): 12bit で転送する 転送量は 3/4 色は 4bit に落ちる
+    """
+
+    def __init__(self, rgb444=False):
+        self.rgb444 = rgb444
         self.cs = Pin(_CS, Pin.OUT)
         self.rst = Pin(_RST, Pin.OUT)
 
@@ -53,9 +101,8 @@ class LCD114(FrameBuffer):
         self.dc = Pin(_DC, Pin.OUT)
         self.dc(1)
 
-        # LCD用のバッファ RGB565
-        self.buf = bytearray(LCD_W * LCD_H * 2)
-        super().__init__(self.buf, LCD_W, LCD_H, RGB565)
+        # LCD用のバッファ
+        self.init_buffer()
 
         # 液晶の明るさ
         self.pwm = PWM(Pin(_BL))
@@ -64,6 +111,22 @@ class LCD114(FrameBuffer):
 
         self.init_display()
 
+    def init_buffer(self):
+        """LCD用のバッファ RGB565 と変換用のバッファ"""
+        self.bpp = 2  # 1ピクセルのバイト数
+        self.buf = bytearray(LCD_W * LCD_H * 2)
+        self.mv = memoryview(self.buf)
+        super().__init__(self.buf, LCD_W, LCD_H, RGB565)
+        self.init_chunk()
+
+    def init_chunk(self):
+        """転送時の変換用バッファ 2ピクセルで3バイト(RGB444) 4バイト(RGB565)"""
+        self.out_bytes = 3 if self.rgb444 else 4
+        if self.rgb444 or self.bpp == 1:
+            self.chunk = bytearray(_CHUNK_PIXELS * self.out_bytes // 2)
+        else:
+            self.chunk = None  # 変換なし
+
     def write_cmd(self, cmd):
         self.cs(1)
         self.dc(0)
@@ -88,7 +151,7 @@ class LCD114(FrameBuffer):
         self.write_data(0x70)
 
         self.write_cmd(0x3A)  # Interface pixel format
-        self.write_data(0x05)
+        self.write_data(0x03 if self.rgb444 else 0x05)  # 12bit | 16bit
 
         self.write_cmd(0xB0)  # RAM Control
         self.write_data(0x00)
@@ -139,38 +202,380 @@ class LCD114(FrameBuffer):
         self.write_cmd(0x11)  # Sleep out
         self.write_cmd(0x29)  # Display On
 
-    def show(self):
-        """バッファ転送"""
+    def set_window(self, x, y, w, h):
+        """転送先の範囲を設定してメモリ書き込みを開始
+        この後 spi.write() でピクセルデータを送り cs(1) で終了
+
+        Params:
+            x (int): X座標
+            y (int): Y座標
+            w (int): 幅
+            h (int): 高さ
+        """
+        x += _OFFSET_X
+        y += _OFFSET_Y
+        x1 = x + w - 1
+        y1 = y + h - 1
+
         self.write_cmd(0x2A)
-        self.write_data(0x00)
-        self.write_data(0x28)
-        self.write_data(0x01)
-        self.write_data(0x17)
+        self.write_data(x >> 8)
+        self.write_data(x & 0xFF)
+        self.write_data(x1 >> 8)
+        self.write_data(x1 & 0xFF)
 
         self.write_cmd(0x2B)
-        self.write_data(0x00)
-        self.write_data(0x35)
-        self.write_data(0x00)
-        self.write_data(0xBB)
+        self.write_data(y >> 8)
+        self.write_data(y & 0xFF)
+        self.write_data(y1 >> 8)
+        self.write_data(y1 & 0xFF)
 
         self.write_cmd(0x2C)
 
         self.cs(1)
         self.dc(1)
         self.cs(0)
-        self.spi.write(self.buf)
+
+    def show(self, y=0, h=LCD_H):
+        """バッファ転送
+
+        Params:
+            y (int): 転送開始行
+            h (int): 行数
+        """
+        self.set_window(0, y, LCD_W, h)
+        if self.rgb444:
+            self.stream(pack444, None, y, h)
+        else:
+            self.spi.write(self.mv[y * LCD_W * 2 : (y + h) * LCD_W * 2])
+        self.cs(1)
+
+    def show_rect(self, x, y, w, h):
+        """バッファの範囲を転送 1行ずつ
+        RGB444 は2ピクセルで3バイトなので X座標と幅は偶数に広げる
+
+        Params:
+            x (int): X座標
+            y (int): Y座標
+            w (int): 幅
+            h (int): 高さ
+        """
+        if x == 0 and w == LCD_W:
+            self.show(y, h)  # 行単位はまとめて
+            return
+        x1 = (x + w + 1) & ~1
+        x &= ~1
+        w = x1 - x
+        self.set_window(x, y, w, h)
+        convert, palette = self.converter()
+        mv = self.mv
+        b = self.bpp
+        chunk = self.chunk
+        write = self.spi.write
+        n = w * b
+        i = (y * LCD_W + x) * b
+        if convert is None:
+            for _ in range(h):
+                write(mv[i : i + n])
+                i += LCD_W * b
+        else:
+            out = memoryview(chunk)[: w * self.out_bytes // 2]
+            for _ in range(h):
+                convert(mv[i : i + n], chunk, w, palette)
+                write(out)
+                i += LCD_W * b
         self.cs(1)
 
+    def converter(self):
+        """転送時の変換
+
+        Returns:
+            tuple: 変換関数, パレット 変換なしなら None, None
+        """
+        if self.rgb444:
+            return (pack444, None)
+        return (None, None)
+
+    def stream(self, convert, palette, y=0, h=LCD_H):
+        """数行ずつ変換して転送
+
+        Params:
+            convert (function): convert(元, 先, ピクセル数, パレット)
+            palette (array): パレット
+            y (int): 転送開始行
+            h (int): 行数
+        """
+        mv = self.mv
+        b = self.bpp
+        chunk = self.chunk
+        cmv = memoryview(chunk)
+        out = self.out_bytes
+        write = self.spi.write
+        n = _CHUNK_PIXELS
+        end = (y + h) * LCD_W
+        for i in range(y * LCD_W, end, n):
+            if i + n > end:
+                n = end - i
+            convert(mv[i * b : (i + n) * b], chunk, n, palette)
+            write(cmv[: n * out // 2])
+
+    def measure_show(self, frames=30):
+        """転送時間の計測 モード毎の比較用
+
+        Returns:
+            tuple: 1フレームの時間 us, 転送バイト数
+        """
+        t = ticks_us()
+        for _ in range(frames):
+            self.show()
+        t = ticks_diff(ticks_us(), t) // frames
+        size = LCD_W * LCD_H * (3 if self.rgb444 else 4) // 2
+        print(
+            "show: %s%s %dus/frame %d bytes"
+            % (
+                "indexed " if self.bpp == 1 else "",
+                "rgb444" if self.rgb444 else "rgb565",
+                t,
+                size,
+            )
+        )
+        return (t, size)
+
+    def blit_rle(self, image, x, y):
+        """不透明な範囲だけバッファにコピー
+        透過色の判定はしない 画面外はクリップ
+
+        Params:
+            image (RLEImage): 画像
+            x (int): X座標
+            y (int): Y座標
+        """
+        dst = self.mv
+        src = image.buf
+        spans = image.spans
+        stride = image.stride
+        b = self.bpp
+        i = 0
+        for row in range(image.h):
+            n = spans[i]
+            i += 1
+            dy = y + row
+            if dy < 0 or dy >= LCD_H:
+                i += n * 2
+                continue
+
+            so = row * stride
+            do = dy * LCD_W + x
+            for _ in range(n):
+                s = spans[i]
+                e = s + spans[i + 1]
+                i += 2
+                # クリップ
+                if x + s < 0:
+                    s = -x
+                if x + e > LCD_W:
+                    e = LCD_W - x
+                if s < e:
+                    dst[(do + s) * b : (do + e) * b] = src[
+                        (so + s) * b : (so + e) * b
+                    ]
+
     def brightness(self, v=2):
         """画面の明るさ"""
         v = brightness_table[v]
         self.pwm.duty_u16(v)  # max 65535
 
 
+@micropython.viper
+def pack444(src, dst, n: int, pal):
+    """RGB565 を RGB444 に 2ピクセルを3バイトに詰める
+
+    Params:
+        src (memoryview): RGB565
+        dst (bytearray): RGB444 R1G1 B1R2 G2B2
+        n (int): ピクセル数（偶数）
+        pal: 使わない
+    """
+    s = ptr16(src)
+    d = ptr8(dst)
+    j = 0
+    for i in range(0, n, 2):
+        a = s[i]
+        b = s[i + 1]
+        d[j] = ((a >> 8) & 0xF0) | ((a >> 7) & 0x0F)
+        d[j + 1] = ((a << 3) & 0xF0) | (b >> 12)
+        d[j + 2] = ((b >> 3) & 0xF0) | ((b >> 1) & 0x0F)
+        j += 3
+
+
+@micropython.viper
+def expand_indexed444(src, dst, n: int, pal):
+    """インデックスカラーを RGB444 に展開 2ピクセルを3バイトに詰める
+
+    Params:
+        src (memoryview): インデックスカラー 1ピクセル1バイト
+        dst (bytearray): RGB444
+        n (int): ピクセル数（偶数）
+        pal (array): パレット RGB444 256色
+    """
+    s = ptr8(src)
+    d = ptr8(dst)
+    p = ptr16(pal)
+    j = 0
+    for i in range(0, n, 2):
+        a = p[s[i]]
+        b = p[s[i + 1]]
+        d[j] = a >> 4
+        d[j + 1] = ((a << 4) & 0xF0) | (b >> 8)
+        d[j + 2] = b & 0xFF
+        j += 3
+
+
+@micropython.viper
+def expand_indexed(src, dst, n: int, pal):
+    """インデックスカラーを RGB565 に展開
+
+    Params:
+        src (memoryview): インデックスカラー 1ピクセル1バイト
+        dst (bytearray): RGB565
+        n (int): ピクセル数
+        pal (array): パレット RGB565 256色
+    """
+    s = ptr8(src)
+    d = ptr16(dst)
+    p = ptr16(pal)
+    for i in range(n):
+        d[i] = p[s[i]]
+
+
+class IndexedLCD114(LCD114):
+    """インデックスカラー（1ピクセル1バイト）のバッファを持つ LCD
+    バッファは RGB565 の半分 転送時に数行ずつパレットで展開する.
+    描画の色は RGB565 で指定し 初めて使う色にパレットを割り当てる（最大256色）.
+    画像は GS8 のインデックスカラーで作る（picogamelib.create_image_buffer）.
+    割り当ては排他しないので 複数のコアで描画する間は freeze() で固定する.
+
+    Attributes:
+        palette (array): パレット RGB565
+        palette444 (array): パレット RGB444（12bit 転送時）
+        index (dict): RGB565 -> パレット番号
+        frozen (bool): パレットを固定中 新しい色は割り当てない
+        misses (int): 割り当てられなかった回数
+    """
+
+    def init_buffer(self):
+        """LCD用のバッファ GS8 と展開用のバッファ"""
+        self.bpp = 1
+        self.buf = bytearray(LCD_W * LCD_H)
+        self.mv = memoryview(self.buf)
+        super(LCD114, self).__init__(self.buf, LCD_W, LCD_H, GS8)
+
+        self.palette = array("H", [0] * 256)
+        self.palette444 = array("H", [0] * 256)
+        self.index = {}
+        self.frozen = False
+        self.misses = 0
+        self.color(0)  # クリア直後のバッファは黒
+        self.init_chunk()
+
+    def set_palette(self, colors):
+        """パレットの先頭から色を登録 画像のインデックスと合わせる
+
+        Params:
+            colors (tuple): RGB565 の色
+        """
+        for c in colors:
+            self.color(c)
+
+    def freeze(self, frozen=True):
+        """パレットを固定 固定中は登録済みの色の参照だけ（両コアから安全）
+
+        Params:
+            frozen (bool): 固定するか
+        """
+        self.frozen = frozen
+
+    def color(self, c):
+        """RGB565 をパレット番号に 無ければ割り当てる
+        固定中・256色を超えた場合は割り当てずに 0 番 最初の1回だけ知らせる
+        """
+        i = self.index.get(c)
+        if i is None:
+            i = len(self.index)
+            if self.frozen or i > 255:
+                self.misses += 1
+                if self.misses == 1:
+                    print(":-( Palette miss 0x%04x" % c)
+                return 0
+            self.index[c] = i
+            self.palette[i] = c
+            self.palette444[i] = (
+                ((c >> 4) & 0xF00) | ((c >> 3) & 0xF0) | ((c >> 1) & 0xF)
+            )
+        return i
+
+    def fill(self, c):
+        super().fill(self.color(c))
+
+    def fill_rect(self, x, y, w, h, c):
+        super().fill_rect(x, y, w, h, self.color(c))
+
+    def rect(self, x, y, w, h, c, f=False):
+        super().rect(x, y, w, h, self.color(c), f)
+
+    def hline(self, x, y, w, c):
+        super().hline(x, y, w, self.color(c))
+
+    def vline(self, x, y, h, c):
+        super().vline(x, y, h, self.color(c))
+
+    def line(self, x0, y0, x1, y1, c):
+        super().line(x0, y0, x1, y1, self.color(c))
+
+    def text(self, s, x, y, c=1):
+        super().text(s, x, y, self.color(c))
+
+    def ellipse(self, x, y, xr, yr, c, f=False, m=15):
+        super().ellipse(x, y, xr, yr, self.color(c), f, m)
+
+    def poly(self, x, y, coords, c, f=False):
+        super().poly(x, y, coords, self.color(c), f)
+
+    def pixel(self, x, y, c=None):
+        if c is None:
+            return self.palette[super().pixel(x, y)]
+        super().pixel(x, y, self.color(c))
+
+    def blit(self, image, x, y, key=-1, palette=None):
+        if key != -1:
+            key = self.color(key)
+        super().blit(image, x, y, key, palette)
+
+    def converter(self):
+        if self.rgb444:
+            return (expand_indexed444, self.palette444)
+        return (expand_indexed, self.palette)
+
+    def show(self, y=0, h=LCD_H):
+        """数行ずつ RGB565 | RGB444 に展開して転送"""
+        self.set_window(0, y, LCD_W, h)
+        if self.rgb444:
+            self.stream(expand_indexed444, self.palette444, y, h)
+        else:
+            self.stream(expand_indexed, self.palette, y, h)
+        self.cs(1)
+
+
 class InputKey:
-    """キー入力"""
+    """キー入力
+    ピンは最初に1回だけ設定して、GPIOレジスタの1回の読み込みで全キーを取得する.
+    同時押しに対応.
+
+    Params:
+        use_register (bool): GPIO入力レジスタを直接読むか（RP2040）
+        latch (bool): 割り込みで押下を記録して、フレーム間の短い押下も拾うか
+    """
 
-    def __init__(self):
+    def __init__(self, use_register=True, latch=True):
         self.repeat = 0
         self.push = 0
         self.frame = 0
@@ -178,32 +583,80 @@ class InputKey:
         self.prev_frame_r = 0
         self.prev_push = 0
         self.double = 0 # ダブルプッシュ
+        self.latched = 0  # 割り込みで記録した押下
+        self.tracer = None  # 入力遅延の計測 LatencyTracer
+        # ピン毎の前回のエッジの時刻（チャタリング除去）
+        self.edge_ticks = array("i", [0] * len(key_pins))
+
+        self.use_register = use_register
+        # ピンは1回だけ設定
+        self.pins = []
+        for i, (n, k) in enumerate(key_pins):
+            pin = Pin(n, Pin.IN, Pin.PULL_UP)
+            self.pins.append((pin, k))
+            if latch:
+                pin.irq(
+                    self.create_handler(k, i),
+                    Pin.IRQ_FALLING | Pin.IRQ_RISING,
+                    hard=True,
+                )
+
+    def create_handler(self, k, i):
+        """割り込みハンドラ 押したキーを記録するだけ
+        押下時刻が遅れないようハード割り込み ヒープを確保しないこと
+        離した時のチャタリングで押下を記録しないように 両エッジで時刻を取り
+        前のエッジから _DEBOUNCE_US 以上安定していた立ち下がりだけを押下とする
+        """
+        falling = Pin.IRQ_FALLING
+
+        def handler(pin):
+            t = ticks_us()
+            d = ticks_diff(t, self.edge_ticks[i])
+            self.edge_ticks[i] = t
+            if 0 <= d < _DEBOUNCE_US or not pin.irq().flags() & falling:
+                return
+            self.latched |= k
+            if self.tracer is not None:
+                self.tracer.edge(i, k, t)
+
+        return handler
+
+    def read(self):
+        """押されているキーを取得"""
+        keys = 0
+        if self.use_register:
+            # プルアップなので押すと 0
+            v = ~mem32[_SIO_GPIO_IN] & _KEY_PIN_MASK
+            for n, k in key_pins:
+                if v & (1 << n):
+                    keys |= k
+        else:
+            for pin, k in self.pins:
+                if pin.value() == 0:
+                    keys |= k
+        return keys
 
     def scan(self):
         """キースキャン
         repeat: 連続キー入力 push: 1回のみ
         """
         self.push = ~self.repeat
-        self.repeat = 0
 
-        if Pin(15, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_A
-        elif Pin(17, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_B
-
-        if Pin(2, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_UP
-        elif Pin(3, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_CENTER
-        elif Pin(16, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_LEFT
-        elif Pin(18, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_DOWN
-        elif Pin(20, Pin.IN, Pin.PULL_UP).value() == 0:
-            self.repeat |= KEY_RIGHT
+        # 前回のスキャン以降に押されて離されたキーも含める
+        state = disable_irq()
+        latched = self.latched
+        self.latched = 0
+        enable_irq(state)
+        self.repeat = self.read() | latched
 
         self.push &= self.repeat
 
+        # 押下が反映されたフレームを記録
+        if self.tracer is not None:
+            state = disable_irq()
+            self.tracer.tag(self.frame, self.repeat)
+            enable_irq(state)
+
         self.double = 0
         # ダブルプッシュ判定
         # left
@@ -227,3 +680,107 @@ class InputKey:
 
         self.frame += 1
 
+
+
+_TRACE_SIZE = const(16)  # 計測中のフレームの最大数
+
+
+class LatencyTracer:
+    """入力遅延の計測
+    キーの押下（割り込み）から、その押下が入力状態に反映されたフレームの
+    LCD転送が完了するまでの時間をヒストグラムに記録する.
+
+    InputKey.tracer に設定すると計測開始.
+    LCD転送が終わったら present() をフレーム番号付きで呼ぶ.
+    tag() はゲームのコア、present() は描画のコアから呼ばれるので
+    書き込むインデックスをコアごとに分けている.
+
+    Params:
+        bucket_ms (int): ヒストグラム 1本の幅 ms
+        buckets (int): ヒストグラムの本数（最後は上限以上）
+
+    Attributes:
+        hist (array): ヒストグラム
+        count (int): 計測数
+        total (int): 合計 us
+        max (int): 最大 us
+    """
+
+    def __init__(self, bucket_ms=5, buckets=16):
+        self.bucket_us = bucket_ms * 1000
+        self.hist = array("H", [0] * buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+        # 押下時刻 キー毎
+        self.edge_ticks = array("i", [0] * len(key_pins))
+        self.edge_keys = 0  # 未反映の押下
+        self.edge_index = array("B", [0] * len(key_pins))
+        for i, (_, k) in enumerate(key_pins):
+            self.edge_index[i] = k
+
+        # 押下が反映されたフレーム リングバッファ
+        self.tag_frame = array("i", [0] * _TRACE_SIZE)
+        self.tag_ticks = array("i", [0] * _TRACE_SIZE)
+        self.head = 0  # tag() が書く
+        self.tail = 0  # present() が書く
+
+    def edge(self, i, k, t):
+        """押下（ハード割り込みから ヒープを確保しない）"""
+        if self.edge_keys & k == 0:
+            self.edge_ticks[i] = t
+            self.edge_keys |= k
+
+    def tag(self, frame, keys):
+        """押下が入力状態に反映されたフレームを記録"""
+        hit = self.edge_keys & keys
+        if hit == 0:
+            return
+
+        # 一番古い押下
+        t = 0
+        first = True
+        for i in range(len(self.edge_index)):
+            if hit & self.edge_index[i]:
+                if first or ticks_diff(self.edge_ticks[i], t) < 0:
+                    t = self.edge_ticks[i]
+                    first = False
+        self.edge_keys &= ~hit
+
+        head = (self.head + 1) % _TRACE_SIZE
+        if head == self.tail:
+            return  # いっぱい
+        self.tag_frame[self.head] = frame
+        self.tag_ticks[self.head] = t
+        self.head = head
+
+    def present(self, frame):
+        """フレームのLCD転送完了"""
+        now = ticks_us()
+        while self.tail != self.head and self.tag_frame[self.tail] <= frame:
+            d = ticks_diff(now, self.tag_ticks[self.tail])
+            i = d // self.bucket_us
+            if i >= len(self.hist):
+                i = len(self.hist) - 1
+            self.hist[i] += 1
+            self.count += 1
+            self.total += d
+            if d > self.max:
+                self.max = d
+            self.tail = (self.tail + 1) % _TRACE_SIZE
+
+    def report(self):
+        """ヒストグラムを表示"""
+        if self.count == 0:
+            print("latency: no samples")
+            return
+
+        print(
+            "latency: n=%d avg=%dms max=%dms"
+            % (self.count, self.total // self.count // 1000, self.max // 1000)
+        )
+        w = self.bucket_us // 1000
+        for i, n in enumerate(self.hist):
+            if n:
+                print("%3d-%3dms %4d %s" % (i * w, i * w + w - 1, n, "#" * min(n, 40)))
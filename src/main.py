@@ -4,10 +4,12 @@ __version__ = "1.0.1"
 __author__ = "Choi Gyun 2024"
 
 import _thread
-from random import randint
-from utime import ticks_ms
+from random import randint, seed
+from utime import ticks_ms, ticks_us, ticks_diff
 from machine import freq
 from gc import collect
+from array import array
+from framebuf import FrameBuffer, RGB565, GS8, GS2_HMSB
 
 from ease import linear, inout_elastic
 from gamedata import (
@@ -27,7 +29,12 @@ from picolcd114 import (
     KEY_LEFT,
     KEY_CENTER,
     LCD_BRIGHTNESS_MAX,
+    LCD_W,
+    LCD_H,
     InputKey,
+    LatencyTracer,
+    LCD114,
+    IndexedLCD114,
 )
 
 from picogamelib import (
@@ -43,9 +50,25 @@ from picogamelib import (
     Stage,
     Sprite,
     SpriteContainer,
+    SpriteBatch,
+    Layer,
     Animator,
+    RES_ATLAS,
+    INDEXED_LCD,
+    NODE_IMAGE,
+    NODE_CONTAINER,
+    resource_manager,
+    sprite_pool,
+    profiler,
+    PROF_VIEW,
+    PROF_LCD,
+    load_file,
+    load_images,
     load_status,
-    save_status,
+    StatusStore,
+    RLEImage,
+    Replay,
+    load_replay,
 )
 
 
@@ -60,15 +83,18 @@ _VIEW_W_END = const(39 + 1)
 
 _SCREEN_X = const(1)  # スクリーン描画 開始座標
 _SCREEN_Y = const(75)
+_SCREEN_W = const(238)  # スクリーン描画 幅（クリアする範囲）
 _PIXEL_W = const(_VIEW_RATIO_W)  # 1ピクセルサイズ
 _PIXEL_H = const(_VIEW_RATIO_H)
 
 _PX_FIX = const(256)  # 描画用 固定小数
 _START_PX = const(_VIEW_W_START * _PX_FIX)  # 水平方向 描画開始座標
-_START_PX2 = const((_VIEW_W_START + 1) * _PX_FIX)  # 水平方向 描画開始座標
-_END_PX = const(_VIEW_W_END * _PX_FIX)  # 水平方向 描画終了座標
+_VIEW_PX_W = const((_VIEW_W_END - _VIEW_W_START) * _PIXEL_W)  # 1行の幅
+_VIEW_BOTTOM = const(_SCREEN_Y + _VIEW_H * _PIXEL_H)  # スクリーン描画 終了座標
+_ROWS_ALL = const((1 << _VIEW_H) - 1)  # 全行を描画
 
 _FIX = const(10)  # 固定小数 10bit
+_HALF_FIX = const(_FIX // 2)  # ゴースト投影用
 _MAX_RAD = const(256)  # 最大角度 256度
 _H_RAD = const(_MAX_RAD // 2)  # 半周角度
 _ATAN_SIZE = const(3)  # atanテーブルの長辺 基準の大きさ
@@ -78,6 +104,10 @@ _COURSE_DATA_H = const(32)
 _COURSE_RATIO = const(4)  # コースデータ（1byte=16px）
 _COURSE_DATA_COL = const(6)  # コースデータ 1行 64px
 _MAX_COURSE = const(6)  # コース数
+_COURSE_W = const(_COURSE_DATA_W << _COURSE_RATIO)  # コースの大きさ
+_COURSE_H = const(_COURSE_DATA_H << _COURSE_RATIO)
+_CLIP_INF = const(0x10000)  # 範囲の制限なし
+_MIP_LEVELS = const(3)  # コースの縮小版 等倍, 1/2, 1/4
 
 ### 描画コマンド
 
@@ -85,6 +115,29 @@ _COMM_VIEW = const(0)  # ビュー座標計算・描画
 _COMM_SPRITE = const(1)  # スプライト描画
 _COMM_LCD = const(2)  # LCDにバッファ転送
 _COMM_EXIT = const(3)  # スレッド終了
+_COMM_SPRITES = const(4)  # スプライト一括描画
+_COMM_PROF = const(5)  # 処理時間の描画
+_COMM_BARRIER = const(6)  # コア0 の描画待ち
+_COMM_MINIMAP = const(7)  # ミニマップのマーカー描画
+
+# 描画スレッドの統計 render_stats のインデックス
+_ST_FRAMES = const(0)  # 描画したフレーム数
+_ST_SKIPS = const(1)  # 変化がなく描画を省いたフレーム数（コア0）
+_ST_BUSY = const(2)  # 新しいフレームの描画時間 us
+_ST_IDLE = const(3)  # 描き直し・キュー待ちの時間 us
+_ST_LOCK_WAIT = const(4)  # コア0 のロック待ち時間 us
+_ST_LOCK_N = const(5)  # コア0 のロック回数
+_ST_SPLIT = const(6)  # コア0 のビュー描画時間 us（描画スレッド待ち含む）
+_ST_CMD = const(7)  # コマンド毎の実行時間 us（デバッグ時のみ）
+_ST_SIZE = const(15)
+
+_SPRITE_MAX = const(32)  # 一括描画できるスプライト数（1フレーム）
+_SPRITE_BUFS = const(3)  # 描画中・転送待ちと重ならないよう3面
+
+# ビューの 0 から _VIEW_SPLIT - 1 行目まではコア0 で描画 0 なら分割しない
+_VIEW_SPLIT = const(10)
+_BAND_H = const(_VIEW_SPLIT * _PIXEL_H)  # コア0 の描画先（帯）の高さ
+_SYNC_TIMEOUT_US = const(100000)  # コア間の待ちの上限 相手が止まっても固まらない
 
 ### カラー
 
@@ -106,6 +159,24 @@ _COL_POWER_OFF = const(0x042A)
 
 _COL_ALPHA = const(0x0726)  # スプライト透過色
 
+# ビューのパレット番号 インデックスカラーのバッファに直接描画する
+pal_index_tbl = pal_tbl
+if INDEXED_LCD:
+    # 描画スレッドの動作中はパレットを固定するので 両コアで描く色は先に登録
+    lcd.set_palette(
+        (
+            _COL_BG,
+            _COL_MINIMAP,
+            _COL_MARKER,
+            _COL_POWER_1,
+            _COL_POWER_2,
+            _COL_POWER_3,
+            _COL_POWER_FLASH,
+            _COL_POWER_OFF,
+        )
+    )
+    pal_index_tbl = tuple(tuple(lcd.color(c) for c in pal) for pal in pal_tbl)
+
 ### ゲームステータス
 
 _GAME_READY = const(0)  # スタート前
@@ -232,6 +303,7 @@ _CHR_FAIL = const(18)
 # 重なり順
 _BG_Z = const(10)  # lap mapなど
 _VIEW_Z = const(100)
+_GHOST_Z = const(150)
 _SHIP_Z = const(200)
 _CRASH_Z = const(300)
 _MES_Z = const(1000)
@@ -247,7 +319,18 @@ _EV_FINISH = const("ev_finish")  # フィニッシュ
 _EV_REVERSE = const("ev_reverse")  # 逆走
 
 ### セーブデータ
-_FILENAME = const("gv100.json")
+_FILENAME = const("gv100.sav")
+_FILENAME_JSON = const("gv100.json")  # 旧形式
+_SAVE_DELAY = const(1500)  # 最後の変更から書き込むまでの時間 ms
+
+### リソース
+_RES_MAIN = const("main.atl")  # メインステージの画像（展開済みアトラス）
+_RES_THUMB = const("thumb:%d")  # コースのプレビュー画像 コース番号
+
+### リプレイ
+_GHOST_FILE = const("ghost%d.rpl")  # ゴースト コース番号 (EXモードは +6)
+_REPLAY_KEYS = const(0b0001_0011)  # 記録するキー B LEFT RIGHT
+_REPLAY_DOUBLE = const(6)  # ダブルクリックのビット位置
 
 
 ### クロック 250MHz 大丈夫？
@@ -278,6 +361,119 @@ def cos_sin(angle):
         return (cos_tbl[angle], sin_tbl[angle])
 
 
+def key_mask(key):
+    """リプレイ用の入力 押下中 B LEFT RIGHT + ダブルクリック LEFT RIGHT"""
+    return (key.repeat & _REPLAY_KEYS) | (
+        (key.double & (KEY_LEFT | KEY_RIGHT)) << _REPLAY_DOUBLE
+    )
+
+
+def ghost_file(course, mode):
+    """ゴーストのファイル名"""
+    return _GHOST_FILE % (course + (mode & 1) * _MAX_COURSE)
+
+
+def shrink_course(src, n):
+    """コースデータを 1/n に縮小 n x n のブロックで一番多いパレット番号
+
+    Params:
+        src (bytes): 等倍のコースデータ
+        n (int): 縮小率
+    Returns:
+        bytearray: 縮小したコースデータ
+    """
+    dst = bytearray((_COURSE_DATA_W // n) * (_COURSE_DATA_H // n))
+    counts = bytearray(256)
+    i = 0
+    for by in range(0, _COURSE_DATA_H * _COURSE_DATA_W, n * _COURSE_DATA_W):
+        for bx in range(by, by + _COURSE_DATA_W, n):
+            best = 0
+            for row in range(bx, bx + n * _COURSE_DATA_W, _COURSE_DATA_W):
+                for j in range(row, row + n):
+                    c = src[j]
+                    k = counts[c] + 1
+                    counts[c] = k
+                    if k > best:  # 同数なら先に揃った方
+                        best = k
+                        dst[i] = c
+            # カウンタを戻す
+            for row in range(bx, bx + n * _COURSE_DATA_W, _COURSE_DATA_W):
+                for j in range(row, row + n):
+                    counts[src[j]] = 0
+            i += 1
+
+    return dst
+
+
+def load_course_map(filename):
+    """コースデータのローダー 遠くの行用の縮小版も作る
+    1段ずつ作るのでプリフェッチでは数フレームに分かれる
+
+    Yields:
+        tuple: (等倍, 1/2, 1/4), サイズ
+    """
+    d, size = load_file(filename)
+    levels = [d]
+    for level in range(1, _MIP_LEVELS):
+        yield None
+        m = shrink_course(d, 1 << level)
+        levels.append(m)
+        size += len(m)
+
+    yield (tuple(levels), size)
+
+
+def load_thumbnail(name):
+    """コースのプレビュー画像のローダー（thumb:コース番号）
+    2bit のインデックス 0: コース外 1: 偶数行 2: 奇数行 描画時にパレットで色を付ける
+    数行ずつ作るのでプリフェッチでは数フレームに分かれる
+
+    Yields:
+        tuple: FrameBuffer, サイズ
+    """
+    course, _ = load_file(course_datafile[int(name.split(":")[1])][0])
+    buf = bytearray(_COURSE_DATA_W * _COURSE_DATA_H // 4)
+    fb = FrameBuffer(buf, _COURSE_DATA_W, _COURSE_DATA_H, GS2_HMSB)
+    pixel = fb.pixel
+    i = 0
+    for y in range(_COURSE_DATA_H):
+        c = 1 + (y & 1)
+        for x in range(_COURSE_DATA_W):
+            if course[i] != _COL_INDEX_OUT:
+                pixel(x, y, c)
+            i += 1
+        if y & 7 == 7:
+            yield None
+
+    yield (fb, len(buf))
+
+
+def course_maps(course):
+    """読み込めなかったときのコースデータ 縮小版も同じ内容"""
+    return tuple(
+        course[: (_COURSE_DATA_W >> i) * (_COURSE_DATA_H >> i)]
+        for i in range(_MIP_LEVELS)
+    )
+
+
+def mip_table():
+    """行ごとのコースの縮小レベル
+    隣の行との奥行きの差がマスの半分より大きければ縮小版を使う
+    """
+    tbl = bytearray(_VIEW_H)
+    for r in range(_VIEW_H - 1):
+        step = (z_scale_tbl[r] - z_scale_tbl[r + 1]) * 2
+        level = 0
+        while level < _MIP_LEVELS - 1 and (1 << (_COURSE_RATIO + level + 1)) <= step:
+            level += 1
+        tbl[r] = level
+
+    return bytes(tbl)
+
+
+mip_tbl = mip_table()
+
+
 def atan(x0, y0, x1, y1):
     """ざっくりしたアークタンジェント
     ２点間の方向と距離を求める"""
@@ -328,82 +524,348 @@ def atan(x0, y0, x1, y1):
 ### スレッド
 
 
-def thread_loop(data, lock):
-    """別スレッド（コア）で実行される座標変換と描画"""
+def thread_loop(data, lock, stats):
+    """別スレッド（コア）で実行される座標変換と描画
+
+    Params:
+        data (list): キュー, 描画中のバッファ, キューのバッファ, 実行中か
+        lock (lock): 共有ロック
+        stats (array): 統計 コア0 から読める
+    """
 
-    while True:
-        lock.acquire()
-        queue = data[0]  # コマンドを取得
-        lock.release()
+    prev = None  # 前回のキュー
+    t = ticks_us()
+    try:
+        while True:
+            lock.acquire()
+            queue = data[0]  # コマンドを取得
+            data[1] = data[2]  # 使用中のスプライトバッファ
+            lock.release()
+
+            # 同じキューは描き直さない
+            if len(queue) == 0 or queue is prev:
+                now = ticks_us()
+                stats[_ST_IDLE] += ticks_diff(now, t)
+                t = now
+                continue
+
+            prev = queue
+            timing = profiler.enabled
+
+            for cmd in queue:
+                # ビュー描画
+                c = cmd[0]
+                if timing:
+                    t0 = ticks_us()
+                if c == _COMM_VIEW:
+                    profiler.begin(PROF_VIEW)
+                    draw_view_v3(cmd)
+                    profiler.end(PROF_VIEW)
+                # スプライト描画
+                elif c == _COMM_SPRITES:
+                    draw_sprites(cmd)
+                elif c == _COMM_SPRITE:
+                    cmd[4].blit(cmd[3], cmd[1], cmd[2], _COL_ALPHA)
+                # LCD転送
+                elif c == _COMM_LCD:
+                    profiler.begin(PROF_LCD)
+                    if cmd[4] is None:
+                        cmd[1].show()
+                    else:
+                        for x, y, w, h in cmd[4]:
+                            cmd[1].show_rect(x, y, w, h)
+                    profiler.end(PROF_LCD)
+                    # 入力遅延の計測
+                    if cmd[2] is not None:
+                        cmd[2].present(cmd[3])
+                # 処理時間
+                elif c == _COMM_PROF:
+                    cmd[1].draw(cmd[2])
+                # ミニマップ
+                elif c == _COMM_MINIMAP:
+                    cmd[1].draw(cmd[2], cmd[3], cmd[4], cmd[5])
+                # コア0 が帯に描いたビューを写す
+                elif c == _COMM_BARRIER:
+                    wait_band(cmd, data, queue)
+                # 終了
+                elif c == _COMM_EXIT:
+                    _thread.exit()
+                if timing:
+                    stats[_ST_CMD + c] += ticks_diff(ticks_us(), t0)
+
+            now = ticks_us()
+            stats[_ST_FRAMES] += 1
+            stats[_ST_BUSY] += ticks_diff(now, t)
+            t = now
+    finally:
+        data[3] = False  # 終了・例外で止まったらコア0 は待たない
+
+
+def wait_band(cmd, data, queue):
+    """コア0 が帯を描き終えるのを待ってバッファに写す
+    キューが替わったら（終了時）・上限を過ぎたら写さずに進む
+    写し終えたら（諦めても）コア0 は次の帯を描いてよい
 
-        if len(queue) == 0:
+    Params:
+        cmd (tuple): _COMM_BARRIER, 同期用, 番号, バッファ, 帯, 行
+        data (list): スレッドに渡すデータ
+        queue (list): 実行中のキュー
+    """
+    _, sync, token, buff, band, rows = cmd
+    if rows:
+        t = ticks_us()
+        while sync[0] < token and data[0] is queue:
+            if ticks_diff(ticks_us(), t) > _SYNC_TIMEOUT_US:
+                break
+        if sync[0] >= token:
+            copy_band(buff, band, rows)
+    sync[1] = token
+
+
+def copy_band(buff, band, rows):
+    """帯に描いたビューの行をバッファに写す 左右のビューの外は残す
+
+    Params:
+        buff (LCD114): 写し先
+        band (memoryview): ビューの 0 から _VIEW_SPLIT - 1 行目を描いた帯
+        rows (int): 写す行のビット
+    """
+    b = buff.bpp
+    dst = buff.mv
+    n = _SCREEN_W * b
+    offset = _SCREEN_Y * LCD_W * b
+    for r in range(_VIEW_SPLIT):
+        if not (rows >> r) & 1:
             continue
+        for y in range(r * _PIXEL_H, (r + 1) * _PIXEL_H):
+            i = (y * LCD_W + _SCREEN_X) * b
+            dst[offset + i : offset + i + n] = band[i : i + n]
+
 
-        for cmd in queue:
-            # ビュー描画
-            c = cmd[0]
-            if c == _COMM_VIEW:
-                draw_view_v3(cmd)
-            # スプライト描画
-            elif c == _COMM_SPRITE:
-                cmd[4].blit(cmd[3], cmd[1], cmd[2], _COL_ALPHA)
-            # LCD転送
-            elif c == _COMM_LCD:
-                cmd[1].show()
-            # 終了
-            elif c == _COMM_EXIT:
-                _thread.exit()
-
-
-def draw_view_v3(cmd):
-    """座標計算・描画"""
-    _, vx, vz, cos, sin, field, buff = cmd
-
-    buff_rect = buff.rect  # メソッドを変数に代入しておく
-    # ビュー部分(画面の下半分)クリア
-    buff_rect(_SCREEN_X, _SCREEN_Y, 238, 60, _COL_BG, True)
-
-    scr_y = _SCREEN_Y  # スクリーン描画開始Y
-    for z, h, pal in zip(z_scale_tbl, h_scale_tbl, pal_tbl):
+def row_rects(rows):
+    """ビューの行のビットを転送する範囲に 続く行はまとめる
+
+    Params:
+        rows (int): 行のビット
+    Returns:
+        list: (x, y, w, h) のリスト
+    """
+    rects = []
+    r = 0
+    while r < _VIEW_H:
+        if not (rows >> r) & 1:
+            r += 1
+            continue
+        start = r
+        while r < _VIEW_H and (rows >> r) & 1:
+            r += 1
+        rects.append((0, _SCREEN_Y + start * _PIXEL_H, LCD_W, (r - start) * _PIXEL_H))
+    return rects
+
+
+def report_render_stats(stats):
+    """描画スレッドの統計を出力"""
+    frames = stats[_ST_FRAMES]
+    if frames == 0:
+        print("render: no frames")
+        return
+
+    total = stats[_ST_BUSY] + stats[_ST_IDLE]
+    print(
+        "render: frames %d skips %d busy %d%%"
+        % (frames, stats[_ST_SKIPS], stats[_ST_BUSY] * 100 // max(total, 1))
+    )
+    print(
+        "  lock wait %dus/frame (%d)"
+        % (stats[_ST_LOCK_WAIT] // frames, stats[_ST_LOCK_N])
+    )
+    print("  split    %5dus/frame (core 0)" % (stats[_ST_SPLIT] // frames))
+    for name, c in (
+        ("view", _COMM_VIEW),
+        ("sprites", _COMM_SPRITES),
+        ("sprite", _COMM_SPRITE),
+        ("lcd", _COMM_LCD),
+        ("prof", _COMM_PROF),
+        ("barrier", _COMM_BARRIER),
+        ("minimap", _COMM_MINIMAP),
+    ):
+        print("  %-8s %5dus/frame" % (name, stats[_ST_CMD + c] // frames))
+
+
+def same_queue(a, b):
+    """同じ描画内容のキューか
+    フレーム番号・同期番号は比べない 処理時間の表示は毎回変わる
+
+    Params:
+        a (list): キュー
+        b (list): 前回のキュー
+    """
+    if len(a) != len(b):
+        return False
+
+    for x, y in zip(a, b):
+        c = x[0]
+        if c != y[0] or c == _COMM_PROF:
+            return False
+        if c == _COMM_SPRITES:
+            # スプライトバッファの中身
+            if x[1][x[2] : x[3]] != y[1][y[2] : y[3]]:
+                return False
+        elif c != _COMM_LCD and c != _COMM_BARRIER and x != y:
+            return False
+
+    return True
+
+
+def draw_sprites(cmd):
+    """スプライト一括描画 画像No, X, Y の並び"""
+    _, buf, start, end, buff, images = cmd
+
+    blit = buff.blit
+    for i in range(start, end, 3):
+        image = images[buf[i]]
+        if type(image) is RLEImage:
+            buff.blit_rle(image, buf[i + 1], buf[i + 2])
+        else:
+            blit(image, buf[i + 1], buf[i + 2], _COL_ALPHA)
+
+
+def clip_span(c, s, lo, hi):
+    """lo <= c - y * s < hi となる整数 y の範囲
+
+    Returns:
+        tuple: 最小, 最大 範囲が無い場合は 最小 > 最大
+    """
+    if s > 0:
+        return ((c - hi) // s + 1, (c - lo) // s)
+    elif s < 0:
+        s = -s
+        return (-((c - lo) // s), -((c - hi) // s) - 1)
+    elif lo <= c < hi:
+        return (-_CLIP_INF, _CLIP_INF)
+    return (1, 0)
+
+
+def draw_view_v3(cmd, top=_SCREEN_Y):
+    """座標計算・描画
+    start から end - 1 行目まで 2つのコアで分担できる
+    rows のビットが立っている行だけ描画 それ以外は前の内容を残す
+    各行でコースに掛かる範囲を先に求め コース外はまとめて描画する
+    top はビューの先頭の行を描くY座標（コア0 の帯なら 0）
+    """
+    _, vx, vz, cos, sin, maps, buff, start, end, rows = cmd
+
+    # メソッドを変数に代入しておく
+    buff_rect = buff.rect
+    tbl = pal_tbl
+    bg = _COL_BG
+    if INDEXED_LCD:
+        # 色の変換を通さずパレット番号で描画 帯は LCD と同じ形式
+        if type(buff) is IndexedLCD114:
+            buff_rect = super(LCD114, buff).rect
+        tbl = pal_index_tbl
+        bg = lcd.color(_COL_BG)
+    scr_y = top + start * _PIXEL_H  # スクリーン描画開始Y
+    # ビュー部分(画面の下半分)クリア 一部の行だけなら行ごと
+    band = (1 << end) - (1 << start)
+    whole = rows & band == band
+    if whole:
+        buff_rect(_SCREEN_X, scr_y, _SCREEN_W, (end - start) * _PIXEL_H, bg, True)
+
+    # コースの範囲 0 <= x < 1024, 0 <= z < 512 （固定小数）
+    x_lo = -vx << _FIX
+    x_hi = (_COURSE_W - vx) << _FIX
+    z_lo = -vz << _FIX
+    z_hi = (_COURSE_H - vz) << _FIX
+
+    for r in range(start, end):
+        if not (rows >> r) & 1:
+            scr_y += _PIXEL_H
+            continue
+        if not whole:
+            buff_rect(_SCREEN_X, scr_y, _SCREEN_W, _PIXEL_H, bg, True)
+
+        z = z_scale_tbl[r]
+        h = h_scale_tbl[r]
+        pal = tbl[r]
+        # 遠くの行は縮小版のコース
+        level = mip_tbl[r]
+        field = maps[level]
+        shift = _COURSE_RATIO + level
+        col_bits = _COURSE_DATA_COL - level  # 1行のビット数
         zcos = z * cos  # z座標（奥行き）の cos, sin
         zsin = z * sin
-        scr_x = _SCREEN_X  # スクリーンの描画開始X座標
-        pw = _PIXEL_W  # ピクセル幅
         col_out = pal[_COL_INDEX_OUT]
 
-        # 最初のピクセルを取得
-        _y = _START_PX // h  # -39 * 256 // h
-        pos_x = (((zcos - _y * sin) >> _FIX) + vx) >> _COURSE_RATIO
-        # pos_y はあらかじめ64倍
-        pos_y = ((((zsin + _y * cos) >> _FIX) + vz) << 2) & 0xFFC0
-        if pos_x < 0 or pos_x >= _COURSE_DATA_W or pos_y < 0 or pos_y >= 2048:
+        # コースに掛かる _y の範囲
+        y0, y1 = clip_span(zcos, sin, x_lo, x_hi)
+        y2, y3 = clip_span(zsin, -cos, z_lo, z_hi)
+        if y2 > y0:
+            y0 = y2
+        if y3 < y1:
+            y1 = y3
+        # 列の範囲に変換 _y = k * 256 // h
+        k0 = -((-y0 * h) // _PX_FIX)
+        k1 = -((-(y1 + 1) * h) // _PX_FIX) - 1
+        if k0 < _VIEW_W_START:
+            k0 = _VIEW_W_START
+        if k1 >= _VIEW_W_END:
+            k1 = _VIEW_W_END - 1
+
+        # コースに掛からない行
+        if y0 > y1 or k0 > k1:
+            if col_out != bg:
+                buff_rect(_SCREEN_X, scr_y, _VIEW_PX_W, _PIXEL_H, col_out, True)
+            scr_y += _PIXEL_H
+            continue
+
+        scr_x = _SCREEN_X  # スクリーンの描画開始X座標
+        if k0 > _VIEW_W_START:
+            # 左側のコース外
             prev_col = col_out
+            pw = (k0 - _VIEW_W_START) * _PIXEL_W
         else:
+            # 最初のピクセルを取得
+            _y = _START_PX // h  # -39 * 256 // h
+            pos_x = (((zcos - _y * sin) >> _FIX) + vx) >> shift
+            # pos_y はあらかじめ行の幅倍
+            pos_y = ((((zsin + _y * cos) >> _FIX) + vz) >> shift) << col_bits
             prev_col = pal[field[pos_x + pos_y]]
+            pw = _PIXEL_W  # ピクセル幅
+            k0 += 1
 
-        for y in range(_START_PX2, _END_PX, _PX_FIX):  # -38*256 <= y <= 39*256
+        for y in range(k0 * _PX_FIX, (k1 + 1) * _PX_FIX, _PX_FIX):
             _y = y // h  # 水平方向の拡縮
             # 回転 コースデータサイズに補正
-            pos_x = (((zcos - _y * sin) >> _FIX) + vx) >> _COURSE_RATIO
-            pos_y = ((((zsin + _y * cos) >> _FIX) + vz) << 2) & 0xFFC0
-            if pos_x < 0 or pos_x >= _COURSE_DATA_W or pos_y < 0 or pos_y >= 2048:
-                col = col_out
-            else:
-                col = pal[field[pos_x + pos_y]]
+            pos_x = (((zcos - _y * sin) >> _FIX) + vx) >> shift
+            pos_y = ((((zsin + _y * cos) >> _FIX) + vz) >> shift) << col_bits
+            col = pal[field[pos_x + pos_y]]
 
             if col == prev_col:
                 # 前回と同じ色
                 pw += _PIXEL_W  # 描画スキップ
             else:
                 # 前回と違うので直前まで描画する BGと同じ場合はスキップ
-                if prev_col != _COL_BG:
+                if prev_col != bg:
                     buff_rect(scr_x, scr_y, pw, _PIXEL_H, prev_col, True)
                 prev_col = col
                 scr_x += pw  # 描画開始座標 更新
                 pw = _PIXEL_W
 
+        # 右側のコース外
+        if k1 < _VIEW_W_END - 1:
+            w = (_VIEW_W_END - 1 - k1) * _PIXEL_W
+            if prev_col == col_out:
+                pw += w
+            else:
+                if prev_col != bg:
+                    buff_rect(scr_x, scr_y, pw, _PIXEL_H, prev_col, True)
+                prev_col = col_out
+                scr_x += pw
+                pw = w
+
         # 最後のピクセル
-        if col == prev_col and col != _COL_BG:
+        if prev_col != bg:
             buff_rect(scr_x, scr_y, pw, _PIXEL_H, prev_col, True)
 
         # 1ライン終了
@@ -434,9 +896,13 @@ class TitleScene(Scene):
                 if game_status["mode"] & 2 == 2:
                     print(";) debug mode on - No damage while debugging.")
                     self.stage.title.d.active = True
+                    self.key.tracer = LatencyTracer()  # 入力遅延の計測
+                    profiler.reset()  # 処理時間の計測
+                    profiler.enabled = True
                 else:
                     print(";) debug mode off")
                     self.stage.title.d.active = False
+                    self.stage.end_trace()
             # ゲーム開始 シーンの切り替えはaction後
             elif self.key.push & KEY_B:
                 d = self.director
@@ -522,6 +988,7 @@ class TitleStage(Stage):
 
     def __init__(self):
         super().__init__("title", 0, 0, def_bg_color)
+        self.on_demand = True  # 変化があった時だけ描画
 
     def enter(self):
         # バッファクリア
@@ -534,16 +1001,29 @@ class TitleStage(Stage):
 
         # デバッグモードはオフ
         game_status["mode"] &= 1
+        self.end_trace()
 
     def leave(self):
         super().leave()
 
+    def end_trace(self):
+        """入力遅延の計測終了 結果を表示"""
+        key = self.scene.key
+        if key.tracer is not None:
+            key.tracer.report()
+            key.tracer = None
+            sprite_pool.report()
+        if profiler.enabled:
+            profiler.report()
+            profiler.enabled = False
+
 
 class ResultsStage(Stage):
     """リザルトのステージ"""
 
     def __init__(self):
         super().__init__("results", 0, 0, 0x194A)
+        self.on_demand = True  # 変化があった時だけ描画
 
     def enter(self):
         super().enter()
@@ -554,11 +1034,60 @@ class ResultsStage(Stage):
 class ThreadStage(Stage):
     """メインシーンのステージ このステージだけ描画を別スレッドに投げる"""
 
+    # インターレース描画 (開始行, 描画間隔)
+    INTERLACE_ROWS = ((0, 2),)  # 偶数行・奇数行を交互
+    INTERLACE_FAR = ((0, 2), (10, 1))  # 奥の行だけ1フレームおき
+    interlace = None  # 既定は毎フレーム全行
+
     def __init__(self):
         super().__init__("main", 0, 0, def_alpha_color)
+        # レース開始を速くするため展開済みアトラスを使う
+        self.res_format = RES_ATLAS
+        # 描画をキューに積むスプライトも平坦化して扱う
+        self.show_kinds[ThreadSprite.show] = NODE_IMAGE
+        self.show_kinds[ThreadSpriteContainer.show] = NODE_CONTAINER
 
         self.lock = _thread.allocate_lock()  # 共有ロック
-        self.thread_data = [()]  # スレッドに渡すデータ
+        # スレッドに渡すデータ キュー, 描画中のバッファ, キューのバッファ, 実行中か
+        self.thread_data = [(), -1, -1, False]
+
+        # コア0 がLCDに直接描画した範囲（パワー・ラップ） まだ送っていない, 送った
+        # 送ったものは描画スレッドがキューを取るまで次のキューにも含める
+        self.touched = []
+        self.touch_sent = []
+        # 最後に送った描画キューとスプライトバッファ 転送だけのキューの番号
+        self.last_queue = ()
+        self.last_buf_index = 0
+        self.touch_index = _SPRITE_BUFS
+
+        # ビュー 描画する行を決めるための前回の姿勢・スプライトの行
+        self.view_args = None
+        self.view_pose = None
+        self.stale_rows = _ROWS_ALL
+        self.sprite_rows = self.prev_sprite_rows = 0
+
+        # ビューの分担 コア0 の描画コマンドと同期用の番号
+        # コア0 は帯に描き 描画スレッドがバリアでバッファに写す
+        # 前のフレームの転送を待たずに描ける
+        self.split_cmd = None
+        self.split_token = 0
+        self.split_sync = array("i", [0, 0])  # 描き終えた番号, 写し終えた番号
+        self.split_pending = 0  # 写し終えるのを待つ帯の番号
+        self.sent_token = 0  # 直前に送ったキューの帯の番号
+        if _VIEW_SPLIT > 0:
+            self.band_buf = bytearray(LCD_W * _BAND_H * lcd.bpp)
+            self.band = FrameBuffer(
+                self.band_buf, LCD_W, _BAND_H, GS8 if lcd.bpp == 1 else RGB565
+            )
+
+        # スプライト一括描画用 画像No, X, Y
+        self.sprite_bufs = [
+            array("h", [0] * (_SPRITE_MAX * 3)) for _ in range(_SPRITE_BUFS)
+        ]
+        self.sprite_buf_index = 0
+
+        # 描画スレッドの統計
+        self.render_stats = array("i", [0] * _ST_SIZE)
 
     def enter(self):
         super().enter()
@@ -602,37 +1131,326 @@ class ThreadStage(Stage):
         ・描画は別スレッド（コア）に投げる
         """
         self.stage_queue = []  # キューを新規作成
+        self.view_rows = -1  # 描き直したビューの行 ビューが無ければ画面全体を転送
+        self.begin_sprites()
 
         # スプライト
-        for s in self.sprite_list:
-            s.show(lcd, self.resources["images"], self.x, self.y)
+        self.update_render_list()
+        self.draw_render_list(lcd)
+
+        # ビュー スプライトの位置から描画する行を決める
+        if self.view_args is not None:
+            self.finish_view()
+
+        # 処理時間
+        if profiler.enabled:
+            self.queue((_COMM_PROF, profiler, lcd))
+
+        # lcd 転送 入力遅延の計測用にフレーム番号を付ける 範囲は送る時に決める
+        key = self.scene.key
+        self.queue((_COMM_LCD, lcd, key.tracer, key.frame - 1, None))
+
+        # 前回と同じ姿勢・スプライトなら描画を省く LCD に直接描いた範囲だけ転送
+        if same_queue(self.stage_queue, self.last_queue):
+            self.split_cmd = None
+            self.sprite_buf_index = self.last_buf_index  # 送ったバッファから選び直す
+            self.render_stats[_ST_SKIPS] += 1
+            if self.touched:
+                self.send_touched()
+            return
+
+        # 描画スレッド ビューは描き直した行だけ転送
+        rects = None
+        if self.view_rows >= 0 and not profiler.enabled:
+            rects = [(0, 0, LCD_W, _SCREEN_Y)] + row_rects(self.view_rows)
+        self.publish(self.stage_queue, self.sprite_buf_index, rects)
+        self.last_queue = self.stage_queue
+        self.last_buf_index = self.sprite_buf_index
+
+        # ビューの分担分をこのコアで描画
+        if self.split_cmd is not None:
+            self.draw_split()
+
+    def publish(self, queue, buf_index, rects):
+        """キューを描画スレッドに渡す
+
+        Params:
+            queue (list): 描画キュー 最後は LCD 転送
+            buf_index (int): スプライトバッファの番号 転送だけなら _SPRITE_BUFS 以上
+            rects (list): 転送する範囲 (x, y, w, h) None なら画面全体
+        """
+        self.acquire_lock()
+        data = self.thread_data
+        if data[1] == data[2]:
+            self.touch_sent = []  # 前のキューは描画スレッドが取った
+        else:
+            # 取られずに破棄 その帯はもう写されない ビューは次で全行描き直す
+            if self.sent_token == self.split_pending:
+                self.split_pending = 0
+            if data[2] < _SPRITE_BUFS:
+                self.view_pose = None
+        # LCD に直接描いた範囲も転送
+        self.touch_sent += self.touched
+        self.touched = []
+        if rects is not None:
+            rects += self.touch_sent
+        queue[-1] = queue[-1][:4] + (rects,)
+        data[0] = queue
+        data[2] = buf_index
+        self.lock.release()
+        self.sent_token = 0
+
+    def send_touched(self):
+        """LCD に直接描いた範囲だけ転送するキューを送る
+        最後の描画キューを描画スレッドがまだ取っていなければ 取られた後に送る
+        （描画キューを転送だけのキューで置き換えない）
+        """
+        data = self.thread_data
+        if data[1] != data[2] and data[2] < _SPRITE_BUFS:
+            return
+        # 続けて送っても取ったか分かるように番号を交互に
+        self.touch_index = _SPRITE_BUFS * 2 + 1 - self.touch_index
+        key = self.scene.key
+        queue = [(_COMM_LCD, lcd, key.tracer, key.frame - 1)]
+        self.publish(queue, self.touch_index, [])
+
+    def touch(self, x, y, w, h):
+        """コア0 が LCD バッファに直接描画した範囲 次のフレームで転送
+
+        Params:
+            x (int): X座標
+            y (int): Y座標
+            w (int): 幅
+            h (int): 高さ
+        """
+        rect = (x, y, w, h)
+        if rect not in self.touched:
+            self.touched.append(rect)
+
+    def set_interlace(self, bands):
+        """インターレース描画の設定
+        行 r はフレーム f で (f + r) % 間隔 == 0 のときだけ描画する
+        スプライトの下の行は毎フレーム描画
+
+        Params:
+            bands (tuple): (開始行, 間隔) の並び None なら全行を毎フレーム
+        """
+        periods = [1] * _VIEW_H
+        for start, period in bands or ():
+            for r in range(start, _VIEW_H):
+                periods[r] = period
+
+        # 間隔の最小公倍数で一巡
+        n = 1
+        for p in periods:
+            m = n
+            while m % p:
+                m += n
+            n = m
+
+        self.interlace_masks = tuple(
+            sum(1 << r for r in range(_VIEW_H) if (f + r) % periods[r] == 0)
+            for f in range(n)
+        )
+        self.view_frame = 0
+
+    def queue_view(self, args):
+        """ビュー描画 コマンドはスプライトが揃ってから確定する
+        奥の行はコア0 で描画 描画スレッドは以降のスプライトの前で待つ
+
+        Params:
+            args (tuple): vx, vz, cos, sin, コースデータ, バッファ
+        """
+        self.flush_sprites()
+        self.view_at = len(self.stage_queue)
+        self.stage_queue.append(None)
+        self.view_args = args
+
+        if _VIEW_SPLIT > 0:
+            self.stage_queue.append(None)  # バリア
+
+    def finish_view(self):
+        """描画する行を決める
+        姿勢が変わったら全行 変わらなければ描き残した行とスプライトの下の行
+        """
+        args = self.view_args
+        self.view_args = None
+
+        pose = args[:5]
+        if pose != self.view_pose:
+            self.view_pose = pose
+            self.stale_rows = _ROWS_ALL
+
+        masks = self.interlace_masks
+        rows = masks[self.view_frame % len(masks)] & self.stale_rows
+        self.view_frame += 1
+        # 前のフレームのスプライトも消す
+        rows |= self.sprite_rows | self.prev_sprite_rows
+        self.prev_sprite_rows = self.sprite_rows
+        self.stale_rows &= ~rows
+        self.view_rows = rows
+
+        self.stage_queue[self.view_at] = (_COMM_VIEW,) + args + (
+            _VIEW_SPLIT,
+            _VIEW_H,
+            rows,
+        )
+        if _VIEW_SPLIT > 0:
+            self.split_token += 1
+            band_rows = rows & ((1 << _VIEW_SPLIT) - 1)
+            self.stage_queue[self.view_at + 1] = (
+                _COMM_BARRIER,
+                self.split_sync,
+                self.split_token,
+                lcd,
+                memoryview(self.band_buf),
+                band_rows,
+            )
+            self.split_cmd = None
+            if band_rows:
+                self.split_cmd = (_COMM_VIEW,) + args[:5] + (
+                    self.band,
+                    0,
+                    _VIEW_SPLIT,
+                    band_rows,
+                )
 
-        # lcd 転送
-        self.stage_queue.append((_COMM_LCD, lcd))
+    def draw_split(self):
+        """ビューの分担分を帯に描画
+        前に描いた帯を描画スレッドが写し終えるまでは待つ（転送は待たない）
+        """
+        t = ticks_us()
+        sync = self.split_sync
+        pending = self.split_pending
+        data = self.thread_data
+        while sync[1] < pending and data[3]:
+            if ticks_diff(ticks_us(), t) > _SYNC_TIMEOUT_US:
+                break
+
+        draw_view_v3(self.split_cmd, 0)
+        self.split_cmd = None
+        sync[0] = self.split_token  # 描画スレッドを進める
+        self.split_pending = self.sent_token = self.split_token
+        self.render_stats[_ST_SPLIT] += ticks_diff(ticks_us(), t)
+
+    def queue(self, cmd):
+        """描画コマンドを追加
+        順番を保つため溜めたスプライトを先に送る
+        """
+        self.flush_sprites()
+        self.stage_queue.append(cmd)
 
-        # 描画スレッド
+    def acquire_lock(self):
+        """ロック 待ち時間を記録"""
+        stats = self.render_stats
+        t = ticks_us()
         self.lock.acquire()
-        self.thread_data[0] = self.stage_queue
+        stats[_ST_LOCK_WAIT] += ticks_diff(ticks_us(), t)
+        stats[_ST_LOCK_N] += 1
+
+    def begin_sprites(self):
+        """スプライトバッファを選ぶ
+        直前に送ったものと描画スレッドが使用中のものは避ける
+        """
+        self.acquire_lock()
+        busy = self.thread_data[1]
         self.lock.release()
 
+        i = (self.sprite_buf_index + 1) % _SPRITE_BUFS
+        if i == busy:
+            i = (i + 1) % _SPRITE_BUFS
+        self.sprite_buf_index = i
+        self.sprite_buf = self.sprite_bufs[i]
+        self.sprite_start = self.sprite_end = 0
+        self.sprite_rows = 0
+
+    def flush_sprites(self):
+        """溜めたスプライトを一括描画コマンドにする"""
+        if self.sprite_end > self.sprite_start:
+            self.stage_queue.append(
+                (
+                    _COMM_SPRITES,
+                    self.sprite_buf,
+                    self.sprite_start,
+                    self.sprite_end,
+                    lcd,
+                    self.resources["images"],
+                )
+            )
+            self.sprite_start = self.sprite_end
+
+    def draw_image(self, frame_buffer, images, chr_no, x, y, w, h):
+        """スプライトバッファに溜める 画面外は送らない"""
+        if x >= LCD_W or y >= LCD_H:
+            return
+        if (w > 0 and x + w <= 0) or (h > 0 and y + h <= 0):
+            return
+
+        # ビューに重なる行 高さ不明なら下まで
+        if y < _VIEW_BOTTOM and (h <= 0 or y + h > _SCREEN_Y):
+            r0 = (y - _SCREEN_Y) // _PIXEL_H
+            if r0 < 0:
+                r0 = 0
+            r1 = _VIEW_H - 1
+            if h > 0 and y + h < _VIEW_BOTTOM:
+                r1 = (y + h - 1 - _SCREEN_Y) // _PIXEL_H
+            self.sprite_rows |= (2 << r1) - (1 << r0)
+
+        n = self.sprite_end
+        if n == _SPRITE_MAX * 3:
+            # 溢れたら1枚ずつ
+            self.queue((_COMM_SPRITE, x, y, images[chr_no], frame_buffer))
+            return
+
+        buf = self.sprite_buf
+        buf[n] = chr_no
+        buf[n + 1] = x
+        buf[n + 2] = y
+        self.sprite_end = n + 3
+
     def action(self):
         if self.status == _GAME_PLAY:
             super().action()
 
     def leave(self):
         self.stop_thread()
+        if profiler.enabled:
+            report_render_stats(self.render_stats)
         super().leave()
 
     def start_thread(self):
         """描画スレッド開始"""
         collect()
-        _thread.start_new_thread(thread_loop, (self.thread_data, self.lock))
+        for i in range(_ST_SIZE):
+            self.render_stats[i] = 0
+        self.thread_data[0] = self.last_queue = ()
+        self.thread_data[3] = True
+        self.touched = []
+        self.touch_sent = []
+        self.split_sync[0] = self.split_sync[1] = 0
+        self.split_token = self.split_pending = self.sent_token = 0
+        self.split_cmd = None
+        # バッファはクリア済み ビューは全行描き直す
+        self.view_pose = None
+        self.prev_sprite_rows = 0
+        self.set_interlace(self.interlace)
+        if INDEXED_LCD:
+            lcd.freeze()  # 両コアで描画する間は新しい色を割り当てない
+        _thread.start_new_thread(
+            thread_loop, (self.thread_data, self.lock, self.render_stats)
+        )
 
     def stop_thread(self):
-        """描画スレッド停止"""
+        """描画スレッド停止 止まるまで（上限まで）待ってからバッファを返す"""
         self.lock.acquire()
         self.thread_data[0] = [(_COMM_EXIT,)]
         self.lock.release()
+        t = ticks_us()
+        while self.thread_data[3]:
+            if ticks_diff(ticks_us(), t) > _SYNC_TIMEOUT_US:
+                break
+        if INDEXED_LCD:
+            lcd.freeze(False)
 
     def ev_enter_frame(self, type, sender, option):
         # 開始前
@@ -672,14 +1490,14 @@ class ThreadSprite(Sprite):
             y += self.y
 
             # 描画データをキュー 親を先に描画
-            self.stage.stage_queue.append(
-                (
-                    _COMM_SPRITE,
-                    x,
-                    y,
-                    images[self.chr_no + self.frame_index],
-                    frame_buffer,
-                )
+            self.stage.draw_image(
+                frame_buffer,
+                images,
+                self.chr_no + self.frame_index,
+                x,
+                y,
+                self.w,
+                self.h,
             )
             for sp in self.sprite_list:
                 sp.show(frame_buffer, images, x, y)
@@ -784,7 +1602,7 @@ class Crash(ThreadSpriteContainer):
 
         # 爆発スプライト
         for _ in range(_BOMB_NUM):
-            b = Bomb()
+            b = self.stage.new_sprite(Bomb)
             self.add_child(b).enter()
             self.bombs.append(b)
 
@@ -875,8 +1693,28 @@ class Burst(ThreadSprite):
 class View(ThreadSprite):
     """コースの疑似3D表示 スプライトとして処理"""
 
+    # リプレイで保存する状態
+    STATE = (
+        "vx",
+        "vz",
+        "dir",
+        "speed",
+        "speed_acc",
+        "speed_limit",
+        "g_speed",
+        "dir_angle",
+        "max_angle",
+        "prev_pixel",
+        "camera_cos",
+        "camera_sin",
+    )
+
     def __init__(self):
         super().__init__(0, "view", 0, 0, _VIEW_Z, _VIEW_W, _VIEW_H)
+        self.course_name = None  # キャッシュ中のコース
+        self.replay = None  # 入力の記録
+        self.ghost = None  # ゴースト
+        self.ghost_replay = None  # 保存待ちの記録（シーン終了時に書き込む）
 
     def enter(self):
         super().enter()
@@ -893,17 +1731,22 @@ class View(ThreadSprite):
         self.course_no = game_status["course"]
         self.load_course_data(self.course_no)
 
+        # 乱数のシード リプレイに記録
+        self.seed = ticks_ms() & 0xFFFF
+        seed(self.seed)
+        # ゴースト
+        self.load_ghost()
+
     def show(self, frame_buffer, images, x, y):
         """フレームバッファに描画"""
-        # 描画データをキュー
-        self.stage.stage_queue.append(
+        # 描画データをキュー 描画する行はステージが決める
+        self.stage.queue_view(
             (
-                _COMM_VIEW,  # ビュー座標計算と描画
                 self.vx >> _FIX,
                 self.vz >> _FIX,
                 self.camera_cos,
                 self.camera_sin,
-                self.course_dat,
+                self.course_maps,
                 frame_buffer,
             )
         )
@@ -935,6 +1778,12 @@ class View(ThreadSprite):
 
     def ev_enter_frame(self, type, sender, key):
         """イベント:毎フレーム"""
+        # 入力を記録
+        if self.replay is not None:
+            self.replay.record(key_mask(key))
+        # ゴースト 自機と同じフレームを進める
+        if self.ghost is not None:
+            self.ghost.step()
         # 操作
         self.operate(key)
         # 移動
@@ -942,6 +1791,49 @@ class View(ThreadSprite):
         # 地形効果判定
         self.apply_field_effects()
 
+    def snapshot(self):
+        """リプレイ用の状態"""
+        return tuple(getattr(self, k) for k in self.STATE)
+
+    def restore(self, state):
+        """リプレイ用の状態を戻す"""
+        for k, v in zip(self.STATE, state):
+            setattr(self, k, v)
+
+    def on_lap(self):
+        """ラップ更新 最初の通過から記録・ゴースト開始"""
+        if self.replay is None and self.ghost_replay is None:
+            self.replay = Replay(
+                self.seed, (self.course_no, self.stage.mode & 1), self.snapshot()
+            )
+            if self.ghost is not None:
+                self.ghost.start()
+
+    def load_ghost(self):
+        """ゴーストのロード 同じコース・モードの記録があれば表示"""
+        mode = self.stage.mode & 1
+        replay = load_replay(ghost_file(self.course_no, mode))
+        if replay is None or replay.info != (self.course_no, mode):
+            return
+
+        self.ghost = Ghost(GhostView(replay, self.course_dat, self.g_src, self.lap))
+        self.stage.add_child(self.ghost).enter()
+
+    def save_ghost(self):
+        """記録をゴーストとして保存
+        レース中にフラッシュに書き込むとフレームが止まるので 記録を止めて
+        シーン終了時（leave）に書き込む
+        """
+        if self.replay is not None:
+            self.ghost_replay = self.replay
+            self.replay = None
+
+    def flush_ghost(self):
+        """保存待ちのゴーストを書き込む"""
+        if self.ghost_replay is not None:
+            self.ghost_replay.save(ghost_file(self.course_no, self.stage.mode & 1))
+            self.ghost_replay = None
+
     def operate(self, key):
         """操作"""
         if self.stage.status == _GAME_PLAY:
@@ -1146,9 +2038,11 @@ class View(ThreadSprite):
 
         # LAP判定
         prev_pixel = pixel
+        lap = False
         if pixel == _COL_INDEX_LAP and self.prev_pixel != _COL_INDEX_LAP:
             if self.dir >= self.lap[0] and self.dir <= self.lap[1]:
                 # ラップ更新
+                lap = True
                 self.event.post(
                     [
                         _EV_RECORD_LAP,
@@ -1181,6 +2075,8 @@ class View(ThreadSprite):
                 )
 
         self.prev_pixel = prev_pixel
+        if lap:
+            self.on_lap()  # 状態を確定してから
 
     def gravity_effect(self, speed):
         """重力"""
@@ -1218,26 +2114,214 @@ class View(ThreadSprite):
         self.g_src = data[2]  # 重力発生源
         self.lap = data[3]  # ゴール範囲
 
-        collect()
+        self.release_course_data()
         try:
-            f = open(data[0], "rb")
+            self.course_maps = resource_manager.acquire(data[0], load_course_map)
         except:
             print(":‑( Load Course Error.")
-            self.course_dat = [0] * (_COURSE_DATA_W * _COURSE_DATA_H)
+            self.course_maps = course_maps([0] * (_COURSE_DATA_W * _COURSE_DATA_H))
+            self.course_dat = self.course_maps[0]
             return
 
-        self.course_dat = f.read()
-        f.close()
+        self.course_dat = self.course_maps[0]  # 等倍 地形効果・ミニマップ用
+
+        self.course_name = data[0]
+
+    def release_course_data(self):
+        """コースデータ返却"""
+        if self.course_name is not None:
+            resource_manager.release(self.course_name)
+            self.course_name = None
+
+    def leave(self):
+        self.flush_ghost()
+        self.release_course_data()
+        return super().leave()
+
+
+class GhostSink:
+    """ゴースト用 ステージ・自機・イベントの代わり 何もしない"""
+
+    status = _GAME_PLAY
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.ship = self
+
+    def post(self, event):
+        pass
+
+    def start_shake(self):
+        pass
+
+    def end_shake(self):
+        pass
+
+    def start_burst(self):
+        pass
+
+    def end_burst(self):
+        pass
+
+
+class ReplayKey:
+    """記録した入力をキーとして扱う"""
+
+    def __init__(self):
+        self.repeat = self.double = 0
+
+    def set(self, mask):
+        self.repeat = mask & _REPLAY_KEYS
+        self.double = mask >> _REPLAY_DOUBLE
+
+
+class GhostView(View):
+    """リプレイを再計算するビュー
+    描画・イベントなしで View と同じ物理を1フレームずつ進める
+
+    Params:
+        replay (Replay): リプレイ
+        course_dat (bytes): コースデータ
+        g_src (tuple): 重力発生源
+        lap (tuple): ゴール範囲
+
+    Attributes:
+        frame (int): 経過フレーム
+        laps (list): ラップ更新したフレーム
+    """
+
+    def __init__(self, replay, course_dat, g_src, lap):
+        super().__init__()
+        self.stage = self.event = GhostSink(replay.info[1])
+        self.course_dat = course_dat
+        self.g_src = g_src
+        self.lap = lap
+
+        self.init_view()
+        self.restore(replay.state)
+        self.key = ReplayKey()
+        self.inputs = replay.play()
+        self.frame = 0
+        self.laps = []
+
+    def step(self):
+        """1フレーム進める
+
+        Returns:
+            bool: 入力が残っていたか
+        """
+        for mask in self.inputs:
+            self.key.set(mask)
+            self.operate(self.key)
+            self.move()
+            self.apply_field_effects()
+            self.frame += 1
+            return True
+        return False
+
+    def on_lap(self):
+        self.laps.append(self.frame)
+
+    def leave(self):
+        pass
+
+
+class Ghost(ThreadSprite):
+    """ゴースト ベストレコードの走りを自機の画像で表示
+    ビューの行に投影するだけで拡縮はしない
+
+    Params:
+        view (GhostView): 再計算するビュー
+    """
+
+    def __init__(self, view):
+        super().__init__(_CHR_SHIP, "ghost", 0, 0, _GHOST_Z, _SP_W, _SP_H)
+        self.view = view
+        self.running = False
+
+    def start(self):
+        """再生開始"""
+        self.running = True
+
+    def step(self):
+        """1フレーム進める"""
+        if self.running and not self.view.step():
+            self.running = False
+
+    def project(self):
+        """自機のビューに投影
+
+        Returns:
+            tuple or None: スクリーン座標 見えなければ None
+        """
+        v = self.stage.view
+        # 丸め誤差を減らすため半分ずつシフト
+        dx = (self.view.vx - v.vx) >> _HALF_FIX
+        dz = (self.view.vz - v.vz) >> _HALF_FIX
+        cos = v.camera_cos
+        sin = v.camera_sin
+        # カメラ座標 奥行きと横
+        z = (dx * cos + dz * sin) >> (_FIX + _HALF_FIX)
+        u = (dz * cos - dx * sin) >> (_FIX + _HALF_FIX)
+        if z < 0 or z > z_scale_tbl[0]:
+            return None
+
+        # 奥行きが一番近い行
+        r = _VIEW_H - 1
+        while z_scale_tbl[r] < z:
+            r -= 1
+        col = u * h_scale_tbl[r] // _PX_FIX
+        if col < _VIEW_W_START or col >= _VIEW_W_END:
+            return None
+
+        return (_SHIP_X + col * _PIXEL_W, _SHIP_Y - (_VIEW_H - 1 - r) * _PIXEL_H)
+
+    def show(self, frame_buffer, images, x, y):
+        if self.active and self.running:
+            pos = self.project()
+            if pos is not None:
+                self.stage.draw_image(
+                    frame_buffer,
+                    images,
+                    self.chr_no,
+                    x + pos[0],
+                    y + pos[1],
+                    self.w,
+                    self.h,
+                )
+
+
+def simulate(filename):
+    """リプレイを描画なしで再計算（物理の確認・ベンチマーク用）
+
+    Returns:
+        tuple: 最後の状態, ラップ更新したフレーム, 時間 ms
+    """
+    replay = load_replay(filename)
+    data = course_datafile[replay.info[0]]
+    course = resource_manager.acquire(data[0], load_course_map)[0]
+    view = GhostView(replay, course, data[2], data[3])
+
+    t = ticks_ms()
+    while view.step():
+        pass
+    t = ticks_diff(ticks_ms(), t)
+
+    resource_manager.release(data[0])
+    return (view.snapshot(), view.laps, t)
 
 
 class Minimap(ThreadSpriteContainer):
-    """ミニマップ表示 スプライトを描画しない"""
+    """ミニマップ表示 スプライトを描画しない
+    コースはレース開始時にマップ画像に描いておき 描画スレッドでマーカーを描く
+    """
 
     def __init__(self):
         super().__init__("map", 4, 7, _BG_Z)
 
         # 前回のマーカー表示の座標
         self.prev = [0] * 2
+        self.surface = None  # マップ画像
 
     def enter(self):
         super().enter()
@@ -1256,51 +2340,66 @@ class Minimap(ThreadSpriteContainer):
         )
 
     def show(self, frame_buffer, images, x, y):
-        """描画"""
-        # なにもしない
-        pass
+        """描画スレッドにマーカーの描画を積む"""
+        if self.surface is not None:
+            prev = self.prev
+            self.stage.queue(
+                (_COMM_MINIMAP, self, frame_buffer, prev[0], prev[1], self.show_flg)
+            )
 
     def init_minimap(self, course, vx, vz):
-        """コースデータを描画"""
+        """コースデータをマップ画像に描画 LCD と同じ形式"""
+        b = lcd.bpp
+        self.format = GS8 if b == 1 else RGB565
+        # マーカーの下の部分画像がバッファからはみ出さないよう1行余分に確保
+        self.buf = bytearray(_COURSE_DATA_W * (_COURSE_DATA_H + 1) * b)
+        surface = FrameBuffer(self.buf, _COURSE_DATA_W, _COURSE_DATA_H, self.format)
+        col = _COL_MINIMAP
+        if b == 1:
+            surface.fill(lcd.color(_COL_BG))
+            col = lcd.color(col)
+
         i = 0
-        _x = self.x
-        _w = _x + _COURSE_DATA_W
-        _y = self.y
-        _h = _y + _COURSE_DATA_H
-        lcd_pixel = lcd.pixel
-        for y in range(_y, _h):
-            for x in range(_x, _w):
-                p = course[i]
+        pixel = surface.pixel
+        for y in range(_COURSE_DATA_H):
+            for x in range(_COURSE_DATA_W):
+                if course[i] != _COL_INDEX_OUT:
+                    pixel(x, y, col)
                 i += 1
-                if p == _COL_INDEX_OUT:
-                    continue
-                col = 0x0726
-                lcd_pixel(x, y, col)
 
         self.prev[0] = vx  # 前回の座標
         self.prev[1] = vz
 
-        # マーカー描画
-        lcd.rect(self.prev[0] + self.x, self.prev[1] + self.y, 4, 4, _COL_MARKER, True)
+        # 描画スレッドが描いたマーカーの座標 None ならマップ画像全体を描く
+        self.drawn = None
+        self.surface = surface
 
-    def ev_update_minimap(self, type, sender, data):
-        """現在位置を更新"""
+    def draw(self, frame_buffer, x, y, show):
+        """マーカー描画（描画スレッド）
+        前回のマーカーの下はマップ画像の同じ範囲で復元
+
+        Params:
+            frame_buffer (FrameBuffer): 描画先
+            x (int): マーカーのX座標（マップ内）
+            y (int): マーカーのY座標（マップ内）
+            show (int): 点滅 0 なら消すだけ
+        """
+        if self.drawn is None:
+            frame_buffer.blit(self.surface, self.x, self.y, -1)
+        else:
+            _x, _y = self.drawn
+            o = (_x + (_y << _COURSE_DATA_COL)) * lcd.bpp
+            part = FrameBuffer(
+                memoryview(self.buf)[o:], 4, 4, self.format, _COURSE_DATA_W
+            )
+            frame_buffer.blit(part, _x + self.x, _y + self.y, -1)
 
-        # 前回を復元
-        _x = self.prev[0]
-        _y = self.prev[1]
-        selfx = self.x
-        selfy = self.y
-        field = data[0]
-        lcd_pixel = lcd.pixel
-        for y in range(_y, _y + 4):
-            for x in range(_x, _x + 4):
-                col = 0
-                idx = field[x + (y << _COURSE_DATA_COL)]
-                if idx != _COL_INDEX_OUT:
-                    col = _COL_MINIMAP
-                lcd_pixel(x + selfx, y + selfy, col)
+        if show:
+            frame_buffer.rect(x + self.x, y + self.y, 4, 4, _COL_MARKER, True)
+        self.drawn = (x, y)
 
+    def ev_update_minimap(self, type, sender, data):
+        """現在位置を更新"""
         x = data[1]
         y = data[2]
         # マーカー位置補正
@@ -1322,10 +2421,6 @@ class Minimap(ThreadSpriteContainer):
             self.interval = _MINIMAP_INTERVAL
             self.show_flg ^= 1
 
-        if self.show_flg:
-            # マーカー描画
-            lcd.rect(x + self.x, y + self.y, 4, 4, _COL_MARKER, True)
-
 
 class Power(ThreadSpriteContainer):
     """パワー表示 スプライトを描画しない"""
@@ -1356,6 +2451,7 @@ class Power(ThreadSpriteContainer):
         elif w < 120:
             col = _COL_POWER_2
 
+        self.stage.touch(0, 0, LCD_W, 3)
         if w > 0:
             lcd.rect(0, 0, w - 1, 3, col, True)
         if w < 240:
@@ -1413,31 +2509,35 @@ class Title(SpriteContainer):
         # タイトルは分割
         for i in range(7):
             self.add_child(
-                Sprite()
-                .init_params(
-                    _CHR_TITLE + i, "title", i * _SP_W, 0, _MES_Z, _SP_W, _SP_H
-                )
-                .enter()
+                self.stage.new_sprite(
+                    Sprite, _CHR_TITLE + i, "title", i * _SP_W, 0, _MES_Z, _SP_W, _SP_H
+                ).enter()
             )
 
         # サブタイトル
-        self.sub = Sprite().init_params(_CHR_SUB, "starcup", 60, 37, _MES_Z, 120, 10)
+        self.sub = self.stage.new_sprite(
+            Sprite, _CHR_SUB, "starcup", 60, 37, _MES_Z, 120, 10
+        )
         self.add_child(self.sub)
 
         # ゲームモード
-        self.ex = Sprite().init_params(_CHR_EX, "ex", 200, 35, _MES_Z, 32, 16)
+        self.ex = self.stage.new_sprite(
+            Sprite, _CHR_EX, "ex", 200, 35, _MES_Z, 32, 16
+        )
         self.add_child(self.ex)
         self.ex.enter()
         self.ex.active = False
         # デバッグモード
-        self.d = Sprite().init_params(_CHR_DEBUG, "debug", 180, 35, _MES_Z, 16, 16)
+        self.d = self.stage.new_sprite(
+            Sprite, _CHR_DEBUG, "debug", 180, 35, _MES_Z, 16, 16
+        )
         self.add_child(self.d)
         self.d.enter()
         self.d.active = False
 
         # クレジット
-        self.credit = Sprite().init_params(
-            _CHR_CREDIT, "choi", 48, 125, _MES_Z, _CREDIT_W, _CREDIT_H
+        self.credit = self.stage.new_sprite(
+            Sprite, _CHR_CREDIT, "choi", 48, 125, _MES_Z, _CREDIT_W, _CREDIT_H
         )
         self.add_child(self.credit)
         self.select_course = SelectCourse()
@@ -1485,78 +2585,92 @@ class SelectCourse(SpriteContainer):
     def __init__(self):
         super().__init__()
         super().init_params("select", 20, 68, 100)
+        self.thumb_name = None  # 使用中のプレビュー画像
+        self.preview = CoursePreview()
 
     def enter(self):
         super().enter()
 
+        # コースのプレビュー
+        self.add_child(self.preview)
+        self.preview.enter()
+
         # 左右矢印
-        sp = Sprite().init_params(_CHR_R_AR, "ar_r", -22, 5, 100, 16, 16)
+        sp = self.stage.new_sprite(Sprite, _CHR_R_AR, "ar_r", -22, 5, 100, 16, 16)
         self.add_child(sp)
         sp.enter()
-        sp = Sprite().init_params(_CHR_L_AR, "ar_l", 74, 5, 100, 16, 16)
+        sp = self.stage.new_sprite(Sprite, _CHR_L_AR, "ar_l", 74, 5, 100, 16, 16)
         self.add_child(sp)
         sp.enter()
         # planet
-        sp = Sprite().init_params(_CHR_PLANET, "planet", 90, -2, 100, 64, 16)
+        sp = self.stage.new_sprite(
+            Sprite, _CHR_PLANET, "planet", 90, -2, 100, 64, 16
+        )
         self.add_child(sp)
         sp.enter()
 
-        self.planet_num = PlanetNum()  # コース
+        self.planet_num = Nums(
+            1, (_CHR_TITLENUM, _REC_NUM_W, _REC_NUM_H), 158, -4, 6, 100
+        )  # コース
         self.add_child(self.planet_num)
         self.planet_num.enter()
-        self.planet_num.update_num()
-        self.title_nums = TitleNums()
+        self.planet_num.update_num(game_status["course"] + 1)
+        self.title_nums = Nums(
+            6, (_CHR_TITLENUM, _REC_NUM_W, _REC_NUM_H), 100, 20, 6, 100
+        )  # ラップ
         self.add_child(self.title_nums)
         self.title_nums.enter()
 
         self.course_num = game_status["course"]
         self.load_course(self.course_num)
 
+    def prefetch(self, num):
+        """前後のコースのプレビュー画像 レース開始に必要なリソースを先読み
+        残りのコースのプレビュー画像は最後
+        """
+        for i in (num + 1, num - 1):
+            resource_manager.prefetch(_RES_THUMB % (i % _MAX_COURSE), load_thumbnail)
+        resource_manager.prefetch(course_datafile[num][0], load_course_map)
+        resource_manager.prefetch(_RES_MAIN, load_images)
+        for i in (num + 1, num - 1):
+            resource_manager.prefetch(
+                course_datafile[i % _MAX_COURSE][0], load_course_map
+            )
+        for i in range(_MAX_COURSE):
+            resource_manager.prefetch(_RES_THUMB % i, load_thumbnail)
+
     def load_course(self, num):
-        """コースマップ"""
-        data = course_datafile[num]
+        """コースのプレビュー画像 先読み済みならキャッシュから"""
+        name = _RES_THUMB % num
 
-        collect()
+        self.release_course()
         try:
-            f = open(data[0], "rb")
+            thumb = resource_manager.acquire(name, load_thumbnail)
         except:
             print(":‑( Error Load Course Data.")
-            self.course = [0] * (_COURSE_DATA_W * _COURSE_DATA_H)
+            self.preview.set_course(None)
             return
 
-        self.course = f.read()
-        f.close()
+        self.thumb_name = name
+        self.preview.set_course(thumb)
+        self.prefetch(num)
 
-    def show(self, frame_buffer, images, x, y):
-        pal = (0x0726, 0x4FEF)
+    def release_course(self):
+        """プレビュー画像返却"""
+        if self.thumb_name is not None:
+            resource_manager.release(self.thumb_name)
+            self.thumb_name = None
+
+    def leave(self):
+        self.release_course()
+        return super().leave()
 
+    def show(self, frame_buffer, images, x, y):
         if self.active:
 
             lcd.line(0, 56, 239, 56, 0xFD00)
             lcd.line(0, 111, 239, 111, 0xFD00)
 
-            if self.course is not None:
-                _x = x + self.x
-                _y = y + self.y
-                lcd.rect(_x - 4, _y - 4, 72, 40, pal[0])
-
-                i = 0
-                pat = 0
-                _w = _x + _COURSE_DATA_W
-                _h = _y + _COURSE_DATA_H
-                course = self.course
-                lcd_pixel = lcd.pixel
-                for py in range(_y, _h):
-                    for px in range(_x, _w):
-                        p = course[i]
-                        i += 1
-                        if p == _COL_INDEX_OUT:
-                            continue
-                        else:
-                            col = pal[pat]
-                        lcd_pixel(px, py, col)
-                    pat = (pat + 1) & 1
-
             super().show(frame_buffer, images, x, y)
 
     def action(self):
@@ -1574,15 +2688,15 @@ class SelectCourse(SpriteContainer):
                 self.course_num = (self.course_num - 1) % _MAX_COURSE
                 self.load_course(self.course_num)
                 game_status["course"] = self.course_num
-                save_status(game_status, _FILENAME)
-                self.planet_num.update_num()
+                status_store.mark_dirty()
+                self.planet_num.update_num(self.course_num + 1)
 
             elif key.push & KEY_RIGHT:
                 self.course_num = (self.course_num + 1) % _MAX_COURSE
                 self.load_course(self.course_num)
                 game_status["course"] = self.course_num
-                save_status(game_status, _FILENAME)
-                self.planet_num.update_num()
+                status_store.mark_dirty()
+                self.planet_num.update_num(self.course_num + 1)
 
             # 画面の明るさ
             if key.push & KEY_UP:
@@ -1590,75 +2704,40 @@ class SelectCourse(SpriteContainer):
                 if game_status["brightness"] == LCD_BRIGHTNESS_MAX:
                     game_status["brightness"] = LCD_BRIGHTNESS_MAX - 1
                 lcd.brightness(game_status["brightness"])
-                save_status(game_status, _FILENAME)
+                status_store.mark_dirty()
 
             elif key.push & KEY_DOWN:
                 game_status["brightness"] -= 1
                 if game_status["brightness"] < 0:
                     game_status["brightness"] = 0
                 lcd.brightness(game_status["brightness"])
-                save_status(game_status, _FILENAME)
-
+                status_store.mark_dirty()
 
-class TitleNums(SpriteContainer):
-    """タイトル画面 コース選択時のラップ表示"""
 
-    def __init__(self):
-        super().__init__()
-        super().init_params("title-lap", 100, 20, 100)
-        self.nums = []
-
-    def enter(self):
-        super().enter()
-        x = 0
-        for i in range(6):
-            s = TitleNum((_CHR_TITLENUM, _REC_NUM_W, _REC_NUM_H), x, 0, 0)
-            x += _REC_NUM_W + (i & 1) * 6
-            self.add_child(s)
-            self.nums.append(s)
-            s.enter()
-
-    def update_num(self, num):
-        for i in range(5, -1, -1):
-            val = num % 10
-            num //= 10
-            self.nums[i].set_num(val)
-
-
-class PlanetNum(SpriteContainer):
-    """タイトル画面 コース番号表示"""
+class CoursePreview(Layer):
+    """コースのプレビュー 枠とプレビュー画像（load_thumbnail）
+    コースを変えた時だけ描き直す
+    """
 
     def __init__(self):
-        super().__init__()
-        super().init_params("planet-num", 158, -4, 100)
-
-    def enter(self):
-        super().enter()
-
-        self.num = TitleNum((_CHR_TITLENUM, _REC_NUM_W, _REC_NUM_H), 0, 0, 0)
-        self.add_child(self.num)
-        self.num.enter()
-
-    def update_num(self):
-        self.num.set_num(game_status["course"] + 1)
+        super().__init__("preview", -4, -4, 72, 40, 0)
+        self.thumb = None
 
+        # プレビュー画像のパレット コース外, 偶数行, 奇数行
+        b = lcd.bpp
+        self.palette = FrameBuffer(bytearray(4 * b), 4, 1, GS8 if b == 1 else RGB565)
+        for i, c in enumerate((def_bg_color, 0x0726, 0x4FEF)):
+            self.palette.pixel(i, 0, lcd.color(c) if b == 1 else c)
 
-class TitleNum(Sprite):
-    """数値スプライト
-    Params:
-        font(tupple): chr, width, height
-        x(int):
-        y(int):
-        val(int): 初期数値
-    """
+    def set_course(self, thumb):
+        """表示するコースのプレビュー画像"""
+        self.thumb = thumb
+        self.invalidate()
 
-    def __init__(self, font, x, y, val):
-        super().__init__()
-        super().init_params(font[0] + val, "num", x, y, _MES_Z, font[1], font[2])
-        self.font = font
-
-    def set_num(self, val):
-        self.chr_no = self.font[0] + val
+    def draw(self, frame_buffer, images, x, y):
+        if self.thumb is not None:
+            frame_buffer.rect(x, y, 72, 40, 0x0726)
+            frame_buffer.blit(self.thumb, x + 4, y + 4, -1, self.palette)
 
 
 class ResultRecords(SpriteContainer):
@@ -1678,9 +2757,9 @@ class ResultRecords(SpriteContainer):
 
         for i in range(3):
             self.add_child(
-                Sprite()
-                .init_params(_CHR_RESULTS + i, "results", i * 32, 0, _MES_Z, 32, 32)
-                .enter()
+                self.stage.new_sprite(
+                    Sprite, _CHR_RESULTS + i, "results", i * 32, 0, _MES_Z, 32, 32
+                ).enter()
             )
 
         self.add_child(ResultsNums()).enter()
@@ -1690,11 +2769,16 @@ class ResultRecords(SpriteContainer):
             if i == 3:
                 blank = 2
             self.add_child(
-                Sprite()
-                .init_params(
-                    _CHR_LAP1 + i, "lap", -60, i * 22 + 38 + blank, _MES_Z, 64, 16
-                )
-                .enter()
+                self.stage.new_sprite(
+                    Sprite,
+                    _CHR_LAP1 + i,
+                    "lap",
+                    -60,
+                    i * 22 + 38 + blank,
+                    _MES_Z,
+                    64,
+                    16,
+                ).enter()
             )
 
         # アニメ
@@ -1737,38 +2821,29 @@ class ResultsNums(SpriteContainer):
         y = 10
         blank = 0
         for lap, time in enumerate(times):
-            nums = []
-            x = 25
             if lap == 3:
                 blank = 5
             if lap == fail:
                 # failアイコン表示
                 self.add_child(
-                    Sprite().init_params(_CHR_FAIL, "fail", 140, y, 100, 32, 16)
+                    self.stage.new_sprite(
+                        Sprite, _CHR_FAIL, "fail", 140, y, 100, 32, 16
+                    )
                 ).enter()
 
-            for i in range(6):
-                s = TitleNum((_CHR_RESULTNUM, _REC_NUM_W, _REC_NUM_H), x, y + blank, 0)
-                x += _REC_NUM_W + (i & 1) * 6
-                self.add_child(s)
-                nums.append(s)
-                s.enter()
-            self.update_num(nums, time)
+            nums = Nums(6, (_CHR_RESULTNUM, _REC_NUM_W, _REC_NUM_H), 25, y + blank, 6)
+            self.add_child(nums)
+            nums.enter()
+            nums.update_num(time)
             y += 21
 
         # ベストレコード
         best = self.stage.scene.director.values[1]
         if best:
             self.add_child(
-                Sprite().init_params(_CHR_NEW, "new", 140, 75, 100, 32, 16)
+                self.stage.new_sprite(Sprite, _CHR_NEW, "new", 140, 75, 100, 32, 16)
             ).enter()
 
-    def update_num(self, nums, time):
-        for i in range(5, -1, -1):
-            val = time % 10
-            time //= 10
-            nums[i].set_num(val)
-
 
 class Lap(ThreadSpriteContainer):
     """周回数・タイム表示"""
@@ -1824,6 +2899,7 @@ class Lap(ThreadSpriteContainer):
                     sp.show(frame_buffer, images, x, y)
 
                 self.show_once -= 1
+                self.stage.touch(x, y, LCD_W - x, _REC_NUM_Y + _REC_NUM_H)
 
     def ev_record_lap(self, type, sender, option):
         """更新: 周回数・タイム"""
@@ -1861,7 +2937,11 @@ class Lap(ThreadSpriteContainer):
 
             # ベストレコード更新
             if self.stage.mode & 2 != 2:
-                self.stage.scene.director.values[1] = self.update_best_record(total)
+                best = self.update_best_record(total)
+                self.stage.scene.director.values[1] = best
+                status_store.mark_dirty()  # シーン切り替え時に保存
+                if best:
+                    self.stage.view.save_ghost()  # ゴースト
             else:
                 self.stage.scene.director.values[1] = False
         else:
@@ -1912,66 +2992,52 @@ class Lap(ThreadSpriteContainer):
         self.lap_time[self.lap_count - 1] -= time
 
 
-class Nums(ThreadSpriteContainer):
-    """数値表示コンテナ
+class Nums(SpriteBatch):
+    """数値表示
     2桁毎にスペース 00 00 00
+    描画スレッドには送らず直接描画
 
     Params:
         digit (int): 桁
         font(tupple): chr, width, height
         x(int):
         y(int):
+        space(int): 2桁毎のスペース
+        z(int):
     """
 
-    def __init__(self, digit, font, x, y):
-        super().__init__("nums", x, y, _MES_Z)
+    def __init__(self, digit, font, x, y, space=4, z=_MES_Z):
+        super().__init__(digit, "nums", x, y, z)
         self.digit = digit
-        self.nums = []
         self.font = font
+        self.space = space
 
     def enter(self):
         super().enter()
 
-        # 数字スプライト 2桁毎にスペース
+        # 数字 2桁毎にスペース
+        self.clear()
         x = 0
         for i in range(self.digit):
-            s = Num(self.font, x, 0, 0)
-            x += self.font[1] + (i & 1) * 4
-            self.add_child(s)
-            self.nums.append(s)
-            s.enter()
+            self.add(self.font[0], x, 0)
+            x += self.font[1] + (i & 1) * self.space
 
-    def show(self, frame_buffer, images, x, y):
-        for sp in self.sprite_list:
-            sp.show(frame_buffer, images, x + self.x, y + self.y)
+        # 書き換えた時に転送する範囲
+        self.w = self.xs[self.digit - 1] + self.font[1]
+        self.h = self.font[2]
 
     def update_num(self, num):
+        chrs = self.chrs
+        changed = False
         for i in range(self.digit - 1, -1, -1):
-            val = num % 10
+            c = self.font[0] + num % 10
+            if chrs[i] != c:
+                chrs[i] = c
+                changed = True
             num //= 10
-            self.nums[i].set_num(val)
-
-
-class Num(ThreadSprite):
-    """数字スプライト
-
-    Params:
-        font(tupple): chr, width, height
-        x(int):
-        y(int):
-        val(int): 初期数値
-    """
-
-    def __init__(self, font, x, y, val):
-        super().__init__(font[0] + val, "num", x, y, _MES_Z, font[1], font[2])
-        self.font = font
-
-    def show(self, frame_buffer, images, x, y):
-        # 描画スレッドで処理しない
-        frame_buffer.blit(images[self.chr_no], x + self.x, y + self.y, def_alpha_color)
-
-    def set_num(self, val):
-        self.chr_no = self.font[0] + val
+        # 変わった時だけ描き直す
+        if changed:
+            self.invalidate()
 
 
 class ReadyGo(ThreadSprite):
@@ -2033,7 +3099,21 @@ class PauseMes(ThreadSprite):
 
 
 # ステータスをロード
-game_status = load_status(_FILENAME)
+status_store = StatusStore(
+    _FILENAME,
+    (
+        ("mode", 0),
+        ("course", 0),
+        ("bestlap", _MAX_COURSE),
+        ("bestlap_ex", _MAX_COURSE),
+        ("displap", _MAX_COURSE),
+        ("displap_ex", _MAX_COURSE),
+        ("brightness", 0),
+    ),
+    _SAVE_DELAY,
+    {"mode": 1},  # デバッグモードは保存しない
+)
+game_status = status_store.load()
 
 if game_status is None:
     # デフォルト
@@ -2046,7 +3126,18 @@ if game_status is None:
         "displap_ex": [595999] * _MAX_COURSE,
         "brightness": 2,  # LCDの明るさ
     }
-    save_status(game_status, _FILENAME)
+
+    # 旧形式から移行 無いキーはデフォルトのまま
+    legacy = load_status(_FILENAME_JSON)
+    if legacy is not None:
+        for k in game_status:
+            if k in legacy:
+                game_status[k] = legacy[k]
+
+if status_store.data is None:
+    status_store.data = game_status
+    status_store.mark_dirty()
+    status_store.flush()
 
 # コースデータ
 # ファイル名, (スタート座標 方向), (重力源座標), (ゴール方向範囲)
@@ -2062,6 +3153,9 @@ course_datafile = (
 # LCDの明るさ
 lcd.brightness(game_status["brightness"])
 
+# リソースのキャッシュ タイトル・メイン・コースが収まるサイズ
+resource_manager.budget = 96 * 1024
+
 key = InputKey()
 director = Director(
     (
@@ -2071,5 +3165,6 @@ director = Director(
     ),
     key,
 )
+director.status = status_store
 director.push("title")
 director.play()
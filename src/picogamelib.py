@@ -28,7 +28,25 @@
 
 [その他]
 ・SpritePool
-  あらかじめスプライトを生成して使用したい場合に。
+  スプライトをクラス毎に再利用。シーンを切り替えても生成し直さない。
+
+・SpriteBatch
+  数字など単純なスプライトを配列でまとめて持つ。
+
+・Layer
+  静的な内容を一度だけ描画してキャッシュ。変わった時だけ描き直す。
+
+・ResourceManager
+  読み込んだリソースをシーンをまたいでキャッシュ。
+
+・StatusStore
+  ステータスをまとめて遅延書き込み。
+
+・Profiler
+  区間毎の処理時間を計測。デバッグ用。
+
+・Replay
+  フレーム毎の入力を記録・再生。ゴーストや物理の確認用。
 
 """
 
@@ -37,11 +55,14 @@ __author__ = "Choi Gyun 2024"
 
 from io import open
 from json import load, dump
-from utime import ticks_ms, ticks_diff
-from framebuf import FrameBuffer, RGB565
+from struct import pack, unpack
+from array import array
+from os import rename, remove
+from utime import ticks_ms, ticks_us, ticks_diff
+from framebuf import FrameBuffer, RGB565, GS8
 from gc import collect
 from micropython import const
-from picolcd114 import LCD114
+from picolcd114 import LCD114, IndexedLCD114, LCD_W, LCD_H
 from gamedata import palette565
 
 
@@ -62,14 +83,58 @@ EV_PRIORITY_LOW = const(1000)
 
 DEFAULT_FPS = const(30)
 """デフォルトFPS"""
+PREFETCH_MARGIN = const(12)
+"""先読みに必要なフレームの残り時間 ms"""
 
 def_bg_color = 0x0000
 """BGカラー"""
 def_alpha_color = 0x0726
 """透過色"""
 
-lcd = LCD114()
+INDEXED_LCD = const(False)
+"""BGバッファをインデックスカラーにする（RAM半分 転送時に展開）"""
+RGB444_LCD = const(False)
+"""LCDに12bitで転送する（転送量 3/4 転送時に変換）"""
+
+lcd = IndexedLCD114(RGB444_LCD) if INDEXED_LCD else LCD114(RGB444_LCD)
 """BGバッファ 全シーン共有"""
+if INDEXED_LCD:
+    lcd.set_palette(palette565)  # 画像のインデックスと合わせる
+
+# リソース形式
+RES_PALETTE = const(0)
+"""インデックスカラー ロード時に展開（省フラッシュ）"""
+RES_ATLAS = const(1)
+"""展開済み RGB565 アトラス 展開処理なし（高速ロード）"""
+
+# プロファイラの区間
+PROF_SCAN = const(0)
+"""キースキャン"""
+PROF_FIRE = const(1)
+"""イベント処理"""
+PROF_ACTION = const(2)
+"""ステージ アクション"""
+PROF_SHOW = const(3)
+"""ステージ 描画"""
+PROF_VIEW = const(4)
+"""疑似3Dビュー（描画スレッド）"""
+PROF_LCD = const(5)
+"""LCD転送"""
+PROF_FRAME = const(6)
+"""1フレームの処理全体"""
+PROF_SLOTS = const(7)
+prof_names = const(("scan", "fire", "action", "show", "view", "lcd", "frame"))
+prof_colors = const((0x07FF, 0xFFE0, 0x07E0, 0xF81F, 0xFD20, 0x001F, 0xFFFF))
+if INDEXED_LCD:
+    lcd.set_palette(prof_colors)  # 描画スレッドからも描くので先に登録
+
+# 描画リストのノード種別
+NODE_CONTAINER = const(0)
+"""子のみ描画"""
+NODE_IMAGE = const(1)
+"""画像を1枚描画"""
+NODE_CUSTOM = const(2)
+"""独自の show() を呼ぶ 子孫の描画も任せる"""
 
 
 def load_status(filename):
@@ -81,7 +146,7 @@ def load_status(filename):
         return None
 
     d = load(f)
-    f.close
+    f.close()
     return d
 
 
@@ -94,22 +159,312 @@ def save_status(d, filename):
         return
 
     dump(d, f)
-    f.close
+    f.close()
     return
 
 
-def create_image_buffer(palette, image_dat, w, h):
+class StatusStore:
+    """ステータスの保存
+    変更時は dirty にするだけで、最後の変更から delay ms 経つか
+    シーンが切り替わったときにまとめて書き込む.
+    一時ファイルに書いてから rename するので書き込み途中で電源が切れても壊れない.
+    JSON ではなく int32 を並べたバイナリで保存する.
+
+    Params:
+        filename (str): ファイル名
+        layout (tuple): (キー, 要素数) のリスト 要素数 0 は数値 1以上はリスト
+        delay (int): 書き込みまでの待ち時間 ms
+        masks (dict): 数値のうち保存するビット キー: マスク（一時的なフラグを除く）
+
+    Attributes:
+        data (dict): ステータス
+        dirty (bool): 未保存の変更があるか
+        dirty_ticks (int): 最後に変更した時刻
+    """
+
+    MAGIC = b"GV\x01"
+
+    def __init__(self, filename, layout, delay=1000, masks=None):
+        self.filename = filename
+        self.layout = layout
+        self.delay = delay
+        self.masks = masks or {}
+        self.data = None
+        self.dirty = False
+        self.dirty_ticks = 0
+
+        # 値の数
+        self.count = 0
+        for _, n in layout:
+            self.count += n if n > 0 else 1
+        self.fmt = "<%di" % self.count
+
+    def load(self):
+        """ステータスロード
+
+        Returns:
+            dict or None: ステータス 読めなかった場合は None
+        """
+        # 置き換え途中で止まった場合は退避したファイル
+        for filename in (self.filename, self.filename + ".bak"):
+            try:
+                f = open(filename, "rb")
+                break
+            except:
+                pass
+        else:
+            return None
+
+        d = f.read()
+        f.close()
+        if d[:3] != self.MAGIC or len(d) != 3 + self.count * 4:
+            print(":-( Status data error.")
+            return None
+
+        values = unpack(self.fmt, d[3:])
+        data = {}
+        i = 0
+        for k, n in self.layout:
+            if n == 0:
+                data[k] = values[i]
+                i += 1
+            else:
+                data[k] = list(values[i : i + n])
+                i += n
+
+        self.data = data
+        return data
+
+    def mark_dirty(self):
+        """変更あり 書き込みは後で"""
+        self.dirty = True
+        self.dirty_ticks = ticks_ms()
+
+    def update(self):
+        """一定時間変更がなければ書き込む（フレームの空き時間に呼ぶ）"""
+        if self.dirty and ticks_diff(ticks_ms(), self.dirty_ticks) >= self.delay:
+            self.flush()
+
+    def flush(self):
+        """未保存の変更を書き込む"""
+        if not self.dirty or self.data is None:
+            return
+
+        values = []
+        for k, n in self.layout:
+            if n == 0:
+                values.append(self.data[k] & self.masks.get(k, -1))
+            else:
+                values.extend(self.data[k])
+
+        filename = self.filename
+        tmp = filename + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(self.MAGIC)
+                f.write(pack(self.fmt, *values))
+            try:
+                rename(tmp, filename)
+            except OSError:
+                # 上書きできないファイルシステム 元のファイルは退避しておく
+                bak = filename + ".bak"
+                try:
+                    remove(bak)  # 前回の残り
+                except OSError:
+                    pass
+                rename(filename, bak)
+                try:
+                    rename(tmp, filename)
+                except OSError:
+                    rename(bak, filename)
+                    raise
+                remove(bak)
+        except OSError:
+            print(":-( File write error.")
+            return
+
+        self.dirty = False
+
+
+class Replay:
+    """入力の記録・再生
+    フレーム毎の入力（1byte）を 入力, 連続フレーム数 のランレングスで持つ
+    入力が変わらない間は増えないので 1周 数百バイト
+
+    Params:
+        seed (int): 乱数のシード
+        info (tuple): 任意の情報 (int) コース番号など
+        state (tuple): 開始時の状態 (int)
+
+    Attributes:
+        frames (int): フレーム数
+        data (bytearray): 入力, フレーム数 の並び
+    """
+
+    MAGIC = b"RP\x01"
+
+    def __init__(self, seed=0, info=(), state=()):
+        self.seed = seed
+        self.info = tuple(info)
+        self.state = tuple(state)
+        self.frames = 0
+        self.data = bytearray()
+
+    def record(self, mask):
+        """1フレーム分の入力を記録
+
+        Params:
+            mask (int): 入力 0..255
+        """
+        data = self.data
+        if len(data) and data[-2] == mask and data[-1] < 255:
+            data[-1] += 1
+        else:
+            data.append(mask)
+            data.append(1)
+        self.frames += 1
+
+    def play(self):
+        """再生 1フレームずつ入力を返すジェネレーター"""
+        data = self.data
+        for i in range(0, len(data), 2):
+            mask = data[i]
+            for _ in range(data[i + 1]):
+                yield mask
+
+    def save(self, filename):
+        """保存
+
+        Returns:
+            bool: 成功したか
+        """
+        ni = len(self.info)
+        ns = len(self.state)
+        try:
+            f = open(filename, "wb")
+            f.write(self.MAGIC)
+            f.write(pack("<iBBI", self.seed, ni, ns, self.frames))
+            f.write(pack("<%di" % (ni + ns), *(self.info + self.state)))
+            f.write(self.data)
+            f.close()
+        except OSError:
+            print(":-( File write error.")
+            return False
+        return True
+
+
+def load_replay(filename):
+    """リプレイのロード
+
+    Returns:
+        Replay or None: 無い・壊れている場合は None
+    """
+    try:
+        f = open(filename, "rb")
+    except OSError:
+        return None
+
+    d = f.read()
+    f.close()
+    n = len(Replay.MAGIC)
+    if d[:n] != Replay.MAGIC or len(d) < n + 10:
+        return None
+
+    seed, ni, ns, frames = unpack("<iBBI", d[n : n + 10])
+    n += 10
+    values = unpack("<%di" % (ni + ns), d[n : n + (ni + ns) * 4])
+    replay = Replay(seed, values[:ni], values[ni:])
+    replay.data = bytearray(d[n + (ni + ns) * 4 :])
+    replay.frames = frames
+    return replay
+
+
+def load_file(filename):
+    """ファイルを読み込む（リソースのローダー）
+
+    Returns:
+        tuple: データ, サイズ
+    """
+    f = open(filename, "rb")
+    d = f.read()
+    f.close()
+    return (d, len(d))
+
+
+class RLEImage(FrameBuffer):
+    """不透明な範囲を持つスプライト画像
+    透過色の判定をせずに範囲ごとコピーして描画できる（LCD114.blit_rle）
+    通常の FrameBuffer としても使える
+
+    Params:
+        buf (bytearray or memoryview): 画像データ RGB565 | GS8
+        w (int): 幅
+        h (int): 高さ
+        stride (int): 1行のピクセル数
+        spans (bytes): 行毎に 範囲数, (開始X, 幅) * 範囲数
+        fmt (int): RGB565 | GS8
+
+    Attributes:
+        buf (memoryview): 画像データ
+        w (int): 幅
+        h (int): 高さ
+        stride (int): 1行のピクセル数
+        spans (bytes): 不透明な範囲
+    """
+
+    def __init__(self, buf, w, h, stride, spans, fmt=RGB565):
+        super().__init__(buf, w, h, fmt, stride)
+        self.buf = memoryview(buf)
+        self.w = w
+        self.h = h
+        self.stride = stride
+        self.spans = spans
+
+
+def expand_spans(spans, h):
+    """不透明な範囲を縦横2倍にする
+
+    Params:
+        spans (bytes): 元画像の範囲
+        h (int): 元画像の高さ
+    """
+    out = bytearray()
+    i = 0
+    for _ in range(h):
+        n = spans[i]
+        row = bytearray(n * 2 + 1)
+        row[0] = n
+        for j in range(1, n * 2 + 1):
+            row[j] = spans[i + j] * 2
+        i += n * 2 + 1
+        out += row
+        out += row
+    return bytes(out)
+
+
+def create_image_buffer(palette, image_dat, w, h, spans=None):
     """インデックスカラーのキャラデータ から RGB565 の描画用フレームバッファを作成
     LCDが小さいので縦横サイズは2倍にする.
+    BGバッファがインデックスカラーなら GS8 で LCD のパレット番号にする.
 
     Params:
         palette (list): パレット
         image_dat (bytes): 画像データ（インデックスカラー）
         w（int）: 幅
         h（int）: 高さ
+        spans (bytes): 不透明な範囲（展開後） 指定すると RLEImage を作成
         1インデックスは 2x2 ピクセル
     """
-    buf565 = FrameBuffer(bytearray(w * h * 2), w, h, RGB565)
+    if lcd.bpp == 1:
+        fmt = GS8
+        palette = [lcd.color(c) for c in palette]
+    else:
+        fmt = RGB565
+    size = w * h * lcd.bpp
+    if spans is None:
+        buf565 = FrameBuffer(bytearray(size), w, h, fmt)
+    else:
+        buf565 = RLEImage(bytearray(size), w, h, w, spans, fmt)
     # バッファに描画
     pos = 0
     for y in range(0, h, 2):
@@ -120,6 +475,115 @@ def create_image_buffer(palette, image_dat, w, h):
     return buf565
 
 
+def load_images(name):
+    """画像リソースの読み込みと展開（リソースマネージャーのローダー）
+    1枚展開するごとに中断するジェネレーター
+    【名前.atl】 展開済みアトラス 無ければ【名前.dat】を展開する
+
+    Params:
+        name (str): リソース名 【ステージ名.dat】 or 【ステージ名.atl】
+    Yields:
+        None: 展開中
+        tuple: 画像リスト, サイズ
+    """
+    if name.endswith(".atl"):
+        # アトラスは RGB565 なのでインデックスカラーのBGバッファには使えない
+        atlas = load_atlas(name) if lcd.bpp == 2 else None
+        if atlas is not None:
+            yield atlas
+            return
+        if lcd.bpp == 2:
+            print(":-| %s not found, expanding .dat instead." % name)
+        name = name[:-4] + ".dat"
+
+    images = []
+    total = 0  # 展開後のサイズ
+    try:
+        f = open(name, "rb")
+    except:
+        print(":‑( Error Load Resources.")
+        yield (images, total)
+        return
+
+    # 先読みを取り消されて途中で閉じられてもファイルは閉じる
+    try:
+        num = int.from_bytes(f.read(1), "big")  # ファイル数
+        for _ in range(num):
+            img_type = int.from_bytes(f.read(1), "big")  # 画像タイプ
+            w = int.from_bytes(f.read(1), "big")  # width
+            h = int.from_bytes(f.read(1), "big")  # height
+            size = int.from_bytes(f.read(2), "big")  # 読み込みサイズ
+            if img_type == 0:
+                # スプライト
+                d = f.read(size)
+                images.append(create_image_buffer(palette565, d, w * 2, h * 2))
+                total += w * h * 4 * lcd.bpp
+            elif img_type == 2:
+                # スプライト 不透明な範囲つき
+                d = f.read(size)
+                n = (w // 2) * h
+                spans = expand_spans(d[n:], h)
+                images.append(create_image_buffer(palette565, d, w * 2, h * 2, spans))
+                total += w * h * 4 * lcd.bpp + len(spans)
+            else:
+                # ビットマップ（フレームバッファを作成しない）
+                images.append(f.read(size))
+                total += size
+            yield None
+    finally:
+        f.close()
+    yield (images, total)
+
+
+def load_atlas(name):
+    """展開済みアトラスのロード
+    アトラスの矩形をそのままフレームバッファとして参照する
+
+    Returns:
+        tuple or None: 画像リスト, サイズ  アトラスが無ければ None
+    """
+    try:
+        f = open(name, "rb")
+    except:
+        return None
+
+    num = int.from_bytes(f.read(1), "big")  # ファイル数
+    aw = int.from_bytes(f.read(2), "big")  # アトラス width
+    ah = int.from_bytes(f.read(2), "big")  # アトラス height
+    rects = f.read(num * 8)  # 矩形テーブル x, y, w, h
+    # 部分矩形の FrameBuffer は開始位置から stride * h 分のバッファが必要
+    # 最後の行に掛かる矩形が収まるよう1行余分に確保
+    size = aw * ah * 2
+    buf = bytearray(size + aw * 2)
+    f.readinto(memoryview(buf)[:size])
+    # 不透明な範囲 (-r で出力した場合のみ)
+    tail = f.read()
+    f.close()
+
+    mv = memoryview(buf)
+    images = []
+    p = 0
+    for i in range(0, num * 8, 8):
+        x = (rects[i] << 8) | rects[i + 1]
+        y = (rects[i + 2] << 8) | rects[i + 3]
+        w = (rects[i + 4] << 8) | rects[i + 5]
+        h = (rects[i + 6] << 8) | rects[i + 7]
+        if x + w > aw or y + h > ah:
+            raise ValueError("atlas rect out of range")
+        # アトラスの部分矩形 コピーしない
+        n = 0
+        if tail:
+            n = (tail[p] << 8) | tail[p + 1]
+            p += 2
+        if n:
+            spans = tail[p : p + n]
+            p += n
+            images.append(RLEImage(mv[(y * aw + x) * 2 :], w, h, aw, spans))
+        else:
+            images.append(FrameBuffer(mv[(y * aw + x) * 2 :], w, h, RGB565, aw))
+    return (images, len(buf) + len(tail))
+
+
 class Sprite:
     """スプライト
     表示キャラクタの基本単位.
@@ -251,10 +715,8 @@ class Sprite:
             bool: 当たっているか
         """
         # 絶対座標を取得
-        px = self.abs_x()
-        py = self.abs_y()
-        sx = sp.abs_x()
-        sy = sp.abs_y()
+        px, py = self.abs_coord()
+        sx, sy = sp.abs_coord()
 
         if (
             px <= sx + sp.w
@@ -278,24 +740,19 @@ class Sprite:
             if s is sp:
                 return sp
 
-        if self.sprite_list == 0:
-            self.sprite_list.append(sp)
-            sp.parent = self
-            sp.init_shortcuts()
-            return sp
-
         # z昇順・新規は後ろに追加
         for i, s in enumerate(self.sprite_list):
             if sp.z < s.z:
-                # 挿入
-                self.sprite_list.insert(i, sp)
-                sp.parent = self
-                sp.init_shortcuts()
-                return sp
+                self.sprite_list.insert(i, sp)  # 挿入
+                break
+        else:
+            self.sprite_list.append(sp)
 
-        self.sprite_list.append(sp)
         sp.parent = self
         sp.init_shortcuts()
+        # 描画リストを作り直す
+        if self.stage is not None:
+            self.stage.tree_dirty = True
 
         return sp
 
@@ -309,6 +766,8 @@ class Sprite:
 
         for i in range(len(self.sprite_list) - 1, -1, -1):
             if self.sprite_list[i] is sp:
+                if self.stage is not None:
+                    self.stage.tree_dirty = True
                 sp.parent = sp.stage = sp.scene = sp.event = None
                 del self.sprite_list[i]
                 return self
@@ -318,12 +777,14 @@ class Sprite:
 
         Params: name(str): スプライト名
         """
-        for i in range(len(self.splite_list) - 1, -1, -1):
+        for i in range(len(self.sprite_list) - 1, -1, -1):
             if self.sprite_list[i].name == name:
+                if self.stage is not None:
+                    self.stage.tree_dirty = True
                 sp = self.sprite_list[i]
                 sp.parent = sp.stage = sp.scene = sp.event = None
                 del self.sprite_list[i]
-                return self
+        return self
 
     def enter(self):
         """入場
@@ -336,8 +797,9 @@ class Sprite:
         """退場
         終了処理
         """
-        for sp in self.sprite_list:
-            sp.leave()  # 子スプライトも退場
+        # 子スプライトも退場 退場時にリストから削除されるので後ろから
+        for i in range(len(self.sprite_list) - 1, -1, -1):
+            self.sprite_list[i].leave()
 
         self.active = False  # 無効化
 
@@ -346,8 +808,8 @@ class Sprite:
             self.event.remove_all_listener(self)
 
         # オーナーがプールの場合は返却
-        if self.owner is SpritePool:
-            self.owner.pool.return_instance(self)
+        if isinstance(self.owner, SpritePool):
+            self.owner.put(self)
 
         # 親から削除
         self.parent.remove_child(self)
@@ -358,20 +820,21 @@ class Sprite:
         """絶対座標 XY"""
         x = self.x
         y = self.y
-        sp = self
-        while True:
-            if sp.parent is None:
-                break
-            x += self.parent.x
-            y += self.parent.y
+        sp = self.parent
+        while sp is not None:
+            x += sp.x
+            y += sp.y
             sp = sp.parent
 
         return (x, y)
 
     def get_root(self):
         """ルートオブジェクトの取得"""
+        if self.stage is not None:
+            return self.stage
+
         sp = self
-        while sp.parent != None:
+        while sp.parent is not None:
             sp = sp.parent
 
         return sp
@@ -445,47 +908,338 @@ class ShapeSprite(SpriteContainer):
                 )
 
 
+class SpriteBatch(Sprite):
+    """スプライトの一括管理
+    画像を出すだけの単純なスプライトを1つのオブジェクトにまとめる
+    座標・画像No・フレームアニメを並列の配列で持ち 要素はインデックスで扱う
+    z 昇順（同じ z は追加順）で描画 子スプライトは持たない
+
+    Params:
+        size (int): 最大数
+        name (str or int): キャラクタ識別の名前
+        x (int): X座標（親からの相対座標）
+        y (int): Y座標（親からの相対座標）
+        z (int): Z座標
+
+    Attributes:
+        size (int): 最大数
+        count (int): 使用数
+        xs (array): X座標（バッチからの相対座標）
+        ys (array): Y座標（バッチからの相対座標）
+        zs (array): Z座標
+        chrs (array): 画像No
+        frame_maxs (bytearray): アニメ用フレーム数
+        frame_indexes (bytearray): アニメ用フレームのインデックス
+        frame_waits (bytearray): アニメ用フレーム切り替えウェイト
+        frame_wait_defs (bytearray): アニメ用フレーム切り替えウェイト デフォルト値
+        actives (bytearray): 表示するか
+        order (list): 描画順のインデックス
+    """
+
+    def __init__(self, size, name="batch", x=0, y=0, z=0):
+        super().__init__()
+        self.init_params(0, name, x, y, z, 0, 0)
+
+        self.size = size
+        self.xs = array("h", [0] * size)
+        self.ys = array("h", [0] * size)
+        self.zs = array("h", [0] * size)
+        self.chrs = array("H", [0] * size)
+        self.frame_maxs = bytearray(size)
+        self.frame_indexes = bytearray(size)
+        self.frame_waits = bytearray(size)
+        self.frame_wait_defs = bytearray(size)
+        self.actives = bytearray(size)
+        self.clear()
+
+    def clear(self):
+        """全て削除"""
+        self.count = 0
+        self.order = []
+
+    def add(self, chr_no, x, y, z=0):
+        """追加
+
+        Params:
+            chr_no (int): 画像No
+            x (int): X座標（バッチからの相対座標）
+            y (int): Y座標（バッチからの相対座標）
+            z (int): Z座標
+        Returns:
+            int: インデックス
+        """
+        i = self.count
+        if i == self.size:
+            raise IndexError("SpriteBatch full")
+        self.count += 1
+
+        self.xs[i] = x
+        self.ys[i] = y
+        self.zs[i] = z
+        self.chrs[i] = chr_no
+        self.frame_maxs[i] = 0
+        self.frame_indexes[i] = 0
+        self.actives[i] = 1
+
+        # z昇順・同じzは後ろに追加
+        zs = self.zs
+        order = self.order
+        for n, j in enumerate(order):
+            if z < zs[j]:
+                order.insert(n, i)
+                break
+        else:
+            order.append(i)
+
+        return i
+
+    def set_chr(self, i, chr_no):
+        """画像Noを変更"""
+        self.chrs[i] = chr_no
+        self.invalidate()
+
+    def set_pos(self, i, x, y):
+        """座標を変更"""
+        self.xs[i] = x
+        self.ys[i] = y
+        self.invalidate()
+
+    def set_active(self, i, active):
+        """表示するか"""
+        self.actives[i] = 1 if active else 0
+        self.invalidate()
+
+    def invalidate(self):
+        """中身が変わった ステージに描き直しを知らせる
+        w, h を設定していればその範囲だけ転送
+        """
+        if self.stage is not None:
+            self.stage.invalidate(self)
+
+    def set_frame(self, i, max=0, wait=4):
+        """フレームアニメを設定
+
+        Params:
+            i (int): インデックス
+            max (int): 最大フレーム数
+            wait (int): 次のフレームまでのウェイト
+        """
+        self.frame_maxs[i] = max
+        self.frame_waits[i] = wait
+        self.frame_wait_defs[i] = wait
+        self.frame_indexes[i] = 0
+
+    def action(self):
+        """フレームアニメをまとめて更新"""
+        if self.active:
+            maxs = self.frame_maxs
+            waits = self.frame_waits
+            indexes = self.frame_indexes
+            for i in range(self.count):
+                if maxs[i] > 0:
+                    waits[i] -= 1
+                    if waits[i] == 0:
+                        waits[i] = self.frame_wait_defs[i]
+                        indexes[i] = (indexes[i] + 1) % maxs[i]
+                        self.invalidate()
+
+    def show(self, frame_buffer, images, x, y):
+        """まとめてフレームバッファに描画"""
+        if self.active:
+            x += self.x
+            y += self.y
+            xs = self.xs
+            ys = self.ys
+            chrs = self.chrs
+            indexes = self.frame_indexes
+            actives = self.actives
+            blit = frame_buffer.blit
+            for i in self.order:
+                if actives[i]:
+                    image = images[chrs[i] + indexes[i]]
+                    if type(image) is RLEImage:
+                        frame_buffer.blit_rle(image, x + xs[i], y + ys[i])
+                    else:
+                        blit(image, x + xs[i], y + ys[i], def_alpha_color)
+
+
+class Layer(SpriteContainer):
+    """描画結果をキャッシュするコンテナ
+    子スプライトと draw() の内容を一度だけ LCD バッファに描画して範囲を保存し
+    以降のフレームは保存したバイト列をコピーするだけ.
+    内容が変わったら invalidate() で描き直す.
+    範囲は不透明な矩形として扱う（下のスプライトは隠れる）.
+    画面からはみ出している間は保存せず毎フレーム描画する.
+
+    Params:
+        name (str): 名前
+        x (int): X座標（親からの相対座標）
+        y (int): Y座標（親からの相対座標）
+        w (int): 幅
+        h (int): 高さ
+        z (int): Z座標 小さい順に描画
+        bg_color (int): 描き直す時の塗りつぶし色
+
+    Attributes:
+        cache (bytearray): 描画結果 LCD バッファと同じ形式
+        dirty (bool): 次の描画で描き直す
+    """
+
+    def __init__(self, name="layer", x=0, y=0, w=0, h=0, z=0, bg_color=def_bg_color):
+        super().__init__()
+        self.init_params(name, x, y, z)
+        self.w = w
+        self.h = h
+        self.bg_color = bg_color
+        self.cache = None
+        self.dirty = True
+
+    def invalidate(self):
+        """内容が変わった 次のフレームで描き直す レイヤーの範囲だけ転送"""
+        self.dirty = True
+        if self.stage is not None:
+            self.stage.invalidate(self)
+
+    def show(self, frame_buffer, images, x, y):
+        if self.active:
+            x += self.x
+            y += self.y
+            w = self.w
+            h = self.h
+            inside = x >= 0 and y >= 0 and x + w <= LCD_W and y + h <= LCD_H
+            if self.dirty or self.cache is None or not inside:
+                frame_buffer.fill_rect(x, y, w, h, self.bg_color)
+                self.draw(frame_buffer, images, x, y)
+                if inside:
+                    self.copy(x, y, True)
+                    self.dirty = False
+            else:
+                self.copy(x, y, False)
+
+    def draw(self, frame_buffer, images, x, y):
+        """内容を描画 既定は子スプライト
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ
+            images (list): イメージバッファのリスト
+            x (int): レイヤーのX座標（絶対座標）
+            y (int): レイヤーのY座標（絶対座標）
+        """
+        for sp in self.sprite_list:
+            sp.show(frame_buffer, images, x, y)
+
+    def copy(self, x, y, save):
+        """LCD バッファの範囲を保存・復元 1行ずつコピー
+
+        Params:
+            x (int): X座標（絶対座標）
+            y (int): Y座標（絶対座標）
+            save (bool): True なら保存 False なら復元
+        """
+        b = lcd.bpp
+        n = self.w * b
+        if self.cache is None:
+            self.cache = bytearray(n * self.h)
+        cache = memoryview(self.cache)
+        mv = lcd.mv
+        o = (y * LCD_W + x) * b
+        j = 0
+        for _ in range(self.h):
+            if save:
+                cache[j : j + n] = mv[o : o + n]
+            else:
+                mv[o : o + n] = cache[j : j + n]
+            o += LCD_W * b
+            j += n
+
+    def leave(self):
+        self.cache = None  # バッファを解放
+        self.dirty = True
+        return super().leave()
+
+
 class SpritePool:
     """スプライトプール
     スプライトを直接生成しないでプールから取得
-    使用後は返却
+    クラス毎の空きリストに leave() で自動返却 取得時に init_params でリセット
 
     Params:
-        parent (sprite): 所属するスプライト
-        cls (class): クラス
-        size (int): プールのサイズ
+        size (int): クラス毎に保持する数の初期値
+        grow (int): 空きリストが溢れたときに増やす数 0 なら増やさない
+        max_size (int): クラス毎に保持する最大数
 
     Attributes:
-        name (str): クラス
-        size (int): プールのサイズ
-        pool (list): スプライトのリスト
+        free (dict): クラス -> 空きリスト
+        limits (dict): クラス -> 保持する数
+        hits (int): 再利用した回数
+        misses (int): 新規作成した回数
+        drops (int): 溢れて捨てた回数
     """
 
-    def __init__(self, clz, size=32):
+    def __init__(self, size=16, grow=8, max_size=64):
         self.size = size
-        self.clz = clz
-        self.pool = []
-        # プール作成
-        for _ in range(size):
+        self.grow = grow
+        self.max_size = max_size
+        self.free = {}
+        self.limits = {}
+        self.hits = self.misses = self.drops = 0
+
+    def reserve(self, clz, n):
+        """あらかじめ生成しておく 引数なしで生成できるクラスのみ
+
+        Params:
+            clz (class): クラス
+            n (int): 数
+        """
+        lst = self.free.setdefault(clz, [])
+        if n > self.limits.get(clz, self.size):
+            self.limits[clz] = min(n, self.max_size)
+        while len(lst) < n:
             sp = clz()
             sp.owner = self
-            self.pool.append(sp)
-
-    def get_instance(self):
-        """インスタンスを取得"""
-        if len(self.pool) == 0:
-            o = self.clz()  # プールが空の時は新規作成
-            o.owner = self
-            return o
+            lst.append(sp)
+
+    def get(self, clz, *params):
+        """インスタンスを取得
+        空いていなければ新規作成
+
+        Params:
+            clz (class): クラス
+            params: init_params に渡す引数 省略時はリセットしない
+        """
+        lst = self.free.get(clz)
+        if lst:
+            sp = lst.pop()
+            self.hits += 1
         else:
-            return self.pool.pop()
+            sp = clz()  # プールが空の時は新規作成
+            sp.owner = self
+            self.misses += 1
+
+        if params:
+            sp.init_params(*params)
+        return sp
 
-    def return_instance(self, sp):
+    def put(self, sp):
         """インスタンスを返却
-        設定したサイズを超えたら捨てる
+        保持数を超えたら増やす 最大数を超えたら捨てる
         """
-        if len(self.pool) < self.size:
-            self.pool.append(sp)
+        clz = type(sp)
+        lst = self.free.setdefault(clz, [])
+        limit = self.limits.get(clz, self.size)
+        if len(lst) >= limit:
+            if self.grow == 0 or limit >= self.max_size:
+                self.drops += 1
+                return
+            self.limits[clz] = min(limit + self.grow, self.max_size)
+        lst.append(sp)
+
+    def report(self):
+        """再利用の状況を出力"""
+        print("pool hit:%d miss:%d drop:%d" % (self.hits, self.misses, self.drops))
+        for clz, lst in self.free.items():
+            limit = self.limits.get(clz, self.size)
+            print("  %s %d/%d" % (clz.__name__, len(lst), limit))
 
 
 class Stage(SpriteContainer):
@@ -496,15 +1250,36 @@ class Stage(SpriteContainer):
 
     Attributes:
         scene (Scene): シーン
+        res_format (int): リソース形式 RES_PALETTE | RES_ATLAS
+        tree_dirty (bool): ツリーが変わったので描画リストを作り直す
+        show_kinds (dict): show() 関数 -> ノード種別 NODE_IMAGE | NODE_CONTAINER
+        on_demand (bool): 変化があった時だけ描画・転送する（静的な画面）
+        dirty (bool): 次のフレームで描き直す 画面全体を転送
+        damaged (list): 内容が変わったスプライト その範囲だけ転送
     """
 
     def __init__(self, name="no_name", x=0, y=0, bg_color=def_bg_color):
+        # 描画リスト ツリー変更で作り直す
+        self.tree_dirty = True
+        # 変化があった時だけ描画 座標・表示・アニメのフレームは自動で検知
+        # 画像No や独自描画の内容を変えたら invalidate()
+        self.on_demand = False
+        self.dirty = True
+        self.damaged = []
+        # show() 関数とノード種別の対応 ここに無い show() は NODE_CUSTOM
+        self.show_kinds = {
+            Sprite.show: NODE_IMAGE,
+            SpriteContainer.show: NODE_CONTAINER,
+        }
+
         super().__init__()
         self.init_params(name, x, y, bg_color)
 
         # ステージのみで利用するリソース
         # 画像, その他
         self.resources = {"images": [], "misc": []}
+        # リソース形式
+        self.res_format = RES_PALETTE
 
     def init_params(self, name, x, y, bg_color):
         """パラメータをセット
@@ -528,74 +1303,603 @@ class Stage(SpriteContainer):
 
         return self
 
+    def build_render_list(self):
+        """描画リストを作り直す
+        ツリーを行きがけ順に平坦化して 親・部分木の終端・種別を並列の配列に持つ
+        0番はステージ自身
+        """
+        sprites = [self]
+        parents = [-1]
+        ends = [0]
+        kinds = [NODE_CONTAINER]
+        acts = [0]
+        draw = []
+        lists = (sprites, parents, ends, kinds, acts)
+        for sp in self.sprite_list:
+            self.flatten(sp, 0, lists, draw, True)
+        ends[0] = len(sprites)
+
+        n = len(sprites)
+        self.rl_sprites = sprites
+        self.rl_parent = array("h", parents)
+        self.rl_end = array("h", ends)
+        self.rl_kind = bytes(kinds)
+        self.rl_act = bytes(acts)
+        self.rl_draw = array("h", draw)
+        self.rl_x = array("i", [0] * n)
+        self.rl_y = array("i", [0] * n)
+        self.rl_vis = bytearray(n)
+        self.tree_dirty = False
+
+    def flatten(self, sp, parent, lists, draw, drawable):
+        """スプライトを描画リストに追加（子孫も）
+
+        Params:
+            sp (Sprite): スプライト
+            parent (int): 親のインデックス
+            lists (tuple): sprites, parents, ends, kinds, acts
+            draw (list): 描画順のインデックス
+            drawable (bool): 描画リストに載せるか（独自描画の子孫は載せない）
+        """
+        sprites, parents, ends, kinds, acts = lists
+        i = len(sprites)
+        kind = self.show_kinds.get(type(sp).show, NODE_CUSTOM)
+        sprites.append(sp)
+        parents.append(parent)
+        ends.append(0)
+        kinds.append(kind)
+        # 独自の action() を持つか
+        acts.append(0 if type(sp).action is Sprite.action else 1)
+
+        if drawable and (
+            kind == NODE_CUSTOM or (kind == NODE_IMAGE and sp.draw_order != 0)
+        ):
+            draw.append(i)
+
+        for c in sp.sprite_list:
+            self.flatten(c, i, lists, draw, drawable and kind != NODE_CUSTOM)
+
+        if drawable and kind == NODE_IMAGE and sp.draw_order == 0:
+            draw.append(i)  # 子を先に描画
+
+        ends[i] = len(sprites)
+
+    def update_render_list(self):
+        """絶対座標と表示フラグを親から順に計算
+        座標はただの属性で変更を検知できないので毎フレーム1パスで求める
+
+        Returns:
+            bool: 前のフレームから座標・表示フラグが変わったか
+        """
+        if self.tree_dirty:
+            self.build_render_list()
+
+        sprites = self.rl_sprites
+        parents = self.rl_parent
+        xs = self.rl_x
+        ys = self.rl_y
+        vis = self.rl_vis
+
+        changed = xs[0] != self.x or ys[0] != self.y or vis[0] != 1
+        xs[0] = self.x
+        ys[0] = self.y
+        vis[0] = 1
+        for i in range(1, len(sprites)):
+            sp = sprites[i]
+            p = parents[i]
+            x = xs[p] + sp.x
+            y = ys[p] + sp.y
+            v = vis[p] if sp.active else 0
+            if x != xs[i] or y != ys[i] or v != vis[i]:
+                xs[i] = x
+                ys[i] = y
+                vis[i] = v
+                changed = True
+        return changed
+
+    def draw_render_list(self, frame_buffer):
+        """描画リストの順にスプライトを描画
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ
+        """
+        images = self.resources["images"]
+        sprites = self.rl_sprites
+        parents = self.rl_parent
+        kinds = self.rl_kind
+        xs = self.rl_x
+        ys = self.rl_y
+        vis = self.rl_vis
+
+        for i in self.rl_draw:
+            sp = sprites[i]
+            if kinds[i] == NODE_IMAGE:
+                if vis[i]:
+                    self.draw_image(
+                        frame_buffer,
+                        images,
+                        sp.chr_no + sp.frame_index,
+                        xs[i],
+                        ys[i],
+                        sp.w,
+                        sp.h,
+                    )
+            else:
+                # 独自描画 親の絶対座標を渡す
+                p = parents[i]
+                if vis[p]:
+                    sp.show(frame_buffer, images, xs[p], ys[p])
+
+    def draw_image(self, frame_buffer, images, chr_no, x, y, w, h):
+        """画像を1枚描画
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ
+            images (list): イメージバッファのリスト
+            chr_no (int): 画像No
+            x (int): X座標（絶対座標）
+            y (int): Y座標（絶対座標）
+            w (int): 幅 0 なら不明
+            h (int): 高さ 0 なら不明
+        """
+        image = images[chr_no]
+        if type(image) is RLEImage:
+            frame_buffer.blit_rle(image, x, y)
+        else:
+            frame_buffer.blit(image, x, y, def_alpha_color)
+
+    def new_sprite(self, clz, *params):
+        """スプライトをプールから取得 leave() で返却される
+
+        Params:
+            clz (class): クラス
+            params: init_params に渡す引数
+        """
+        return sprite_pool.get(clz, *params)
+
     def action(self):
-        """スプライトのアクションを実行"""
+        """スプライトのアクションを実行
+        描画リストを先頭から辿る 無効なスプライトと独自の action() の子孫は飛ばす
+        Sprite.action() と同じく 子のアクションが先 親のフレームカウントは後
+        途中で外されたスプライトは飛ばす（描画リストはフレームの最後まで古いまま）
+        """
         if self.active:
-            for s in self.sprite_list:
-                s.action()
+            if self.tree_dirty:
+                self.build_render_list()
+
+            sprites = self.rl_sprites
+            parents = self.rl_parent
+            ends = self.rl_end
+            acts = self.rl_act
+            n = len(sprites)
+            anim = []  # 子を処理中のアニメするスプライト
+            i = 1
+            while True:
+                # 部分木が終わったら親のフレームカウント
+                while anim and ends[anim[-1]] <= i:
+                    sp = sprites[anim.pop()]
+                    sp.frame_wait -= 1
+                    if sp.frame_wait == 0:
+                        sp.frame_wait = sp.frame_wait_def
+                        sp.frame_index = (sp.frame_index + 1) % sp.frame_max
+                        self.dirty = True
+                if i >= n:
+                    break
+
+                sp = sprites[i]
+                if self.tree_dirty and sp.parent is not sprites[parents[i]]:
+                    i = ends[i]  # 外された
+                elif acts[i]:
+                    # 独自のアクション 子孫も任せる
+                    sp.action()
+                    i = ends[i]
+                elif sp.active:
+                    if sp.frame_max > 0:
+                        anim.append(i)
+                    i += 1
+                else:
+                    i = ends[i]
 
     def show(self):
         """ステージを更新
         ・スプライトをバッファに描画
+        ・on_demand なら変化がない時は描画も転送もしない（LCDに前の画面が残る）
+          内容が変わったスプライトだけなら その範囲だけ転送
         """
+        full = True
         if self.active:
+            changed = self.update_render_list()
+            full = changed or self.dirty or profiler.enabled or not self.on_demand
+            if not full and not self.damaged:
+                return
+            self.dirty = False
+
             # BGバッファ 塗りつぶし
             if self.bg_color != def_alpha_color:
                 lcd.fill(self.bg_color)
 
             # 子スプライトをバッファに描画
-            for s in self.sprite_list:
-                s.show(lcd, self.resources["images"], self.x, self.y)
+            self.draw_render_list(lcd)
+
+        # 処理時間
+        if profiler.enabled:
+            profiler.draw(lcd)
 
         # LCDに転送
-        lcd.show()
+        profiler.begin(PROF_LCD)
+        if full:
+            lcd.show()
+        else:
+            self.show_damaged()
+        self.damaged = []
+        profiler.end(PROF_LCD)
+        self.present()
+
+    def show_damaged(self):
+        """内容が変わったスプライトの範囲だけ LCD に転送
+        描画リストに無ければ画面全体
+        """
+        sprites = self.rl_sprites
+        for sp in self.damaged:
+            if sp not in sprites:
+                lcd.show()
+                return
+            i = sprites.index(sp)
+            if not self.rl_vis[i]:
+                continue
+            # 画面内にクリップ
+            x = self.rl_x[i]
+            y = self.rl_y[i]
+            x1 = min(x + sp.w, LCD_W)
+            y1 = min(y + sp.h, LCD_H)
+            x = max(x, 0)
+            y = max(y, 0)
+            if x < x1 and y < y1:
+                lcd.show_rect(x, y, x1 - x, y1 - y)
+
+    def present(self):
+        """フレームの表示完了 LCD に転送した時だけ呼ぶ"""
+        # 入力遅延の計測
+        key = self.scene.key
+        if key is not None and key.tracer is not None:
+            key.tracer.present(key.frame - 1)
+
+    def invalidate(self, sp=None):
+        """次のフレームで描き直す
+
+        Params:
+            sp (Sprite): 内容が変わったスプライト
+                w, h があればその範囲だけ転送 None なら画面全体
+        """
+        if sp is None or sp.w <= 0 or sp.h <= 0:
+            self.dirty = True
+        elif self.on_demand and sp not in self.damaged:
+            self.damaged.append(sp)
 
     def enter(self):
         """ステージの初期化処理 リソース読み込み等"""
 
         self.load_resources()
+        self.dirty = True
+        self.damaged = []
         super().enter()
 
     def leave(self):
         """リソースの破棄"""
-        for sp in self.sprite_list:
-            sp.leave()
+        for i in range(len(self.sprite_list) - 1, -1, -1):
+            self.sprite_list[i].leave()
 
         # リソースの破棄
         self.release_resources()
 
     def load_resources(self):
-        """リソースのロード"""
+        """リソースのロード
+        キャッシュにあれば再利用する
+        """
+        self.resources["images"] = resource_manager.acquire(
+            self.resource_name(), load_images
+        )
+
+    def resource_name(self):
+        """キャッシュ用のリソース名"""
+        if self.res_format == RES_ATLAS:
+            return self.name + ".atl"
+        return self.name + ".dat"
+
+    def release_resources(self):
+        """リソースの破棄
+        キャッシュには残る（リソースマネージャーが管理）
+        """
+        resource_manager.release(self.resource_name())
+        self.resources["images"] = []
+        self.resources["misc"].clear()
         collect()
-        try:
-            # リソースは【ステージ名.dat】
-            f = open(self.name + ".dat", "rb")
-        except:
-            print(":‑( Error Load Resources.")
+
+
+class ResourceManager:
+    """リソース管理
+    展開済みのリソースを名前でキャッシュする.
+    参照カウントが 0 になっても破棄せずに残しておき、
+    予算を超えたら最後に使った時刻が古いものから破棄する（LRU）.
+
+    Params:
+        budget (int): キャッシュに使うメモリの上限（バイト）
+
+    ローダーは (データ, サイズ) を返す関数
+    または 少しずつ読み込んで最後に (データ, サイズ) を yield するジェネレーター.
+    prefetch() で登録したリソースは step() でフレームの空き時間に少しずつ読み込む.
+
+    Attributes:
+        budget (int): キャッシュに使うメモリの上限（バイト）
+        used (int): キャッシュ中のリソースのサイズ合計
+        entries (dict): 名前: [データ, サイズ, 参照カウント]
+        lru (list): 名前のリスト 古い順
+        pending (list): プリフェッチ待ち [名前, ローダー, ジェネレーター]
+    """
+
+    def __init__(self, budget=64 * 1024):
+        self.budget = budget
+        self.used = 0
+        self.entries = {}
+        self.lru = []
+        self.pending = []
+
+    def acquire(self, name, loader):
+        """リソースを取得 参照カウントを増やす
+        キャッシュに無ければローダーで読み込む
+
+        Params:
+            name (str): リソース名
+            loader (function): loader(name) -> (データ, サイズ)
+        Returns:
+            obj: リソース
+        """
+        e = self.entries.get(name)
+        if e is None:
+            self.cancel(name)  # プリフェッチ中なら最初から読み込む
+            e = self.load(name, loader)
+        else:
+            # 最近使ったものは後ろに
+            self.lru.remove(name)
+            self.lru.append(name)
+
+        e[2] += 1
+        return e[0]
+
+    def release(self, name):
+        """リソースを返却 参照カウントを減らす（破棄はしない）"""
+        e = self.entries.get(name)
+        if e is not None and e[2] > 0:
+            e[2] -= 1
+
+    def is_cached(self, name):
+        """キャッシュ済みか"""
+        return name in self.entries
+
+    def prefetch(self, name, loader):
+        """リソースを先読み予約
+        step() で少しずつ読み込む
+
+        Params:
+            name (str): リソース名
+            loader (function): ローダー
+        """
+        if name in self.entries:
             return
+        for p in self.pending:
+            if p[0] == name:
+                return
+        self.pending.append([name, loader, None])
 
-        num = int.from_bytes(f.read(1), "big")  # ファイル数
-        for _ in range(num):
-            img_type = int.from_bytes(f.read(1), "big")  # 画像タイプ
-            w = int.from_bytes(f.read(1), "big")  # width
-            h = int.from_bytes(f.read(1), "big")  # height
-            size = int.from_bytes(f.read(2), "big")  # 読み込みサイズ
-            if img_type == 0:
-                # スプライト
-                self.resources["images"].append(
-                    create_image_buffer(palette565, f.read(size), w * 2, h * 2)
-                )
+    def cancel(self, name):
+        """先読みを取り消し 読み込み途中のジェネレーターは閉じる"""
+        for i in range(len(self.pending) - 1, -1, -1):
+            p = self.pending[i]
+            if p[0] == name:
+                if p[2] is not None:
+                    p[2].close()  # ローダーが開いたファイルを閉じる
+                del self.pending[i]
+
+    def step(self):
+        """先読みを少しだけ進める
+        ジェネレーターのローダーは1回分 関数のローダーは1つ読み込む
+
+        Returns:
+            bool: まだ先読みが残っているか
+        """
+        if not self.pending:
+            return False
+
+        p = self.pending[0]
+        try:
+            if p[2] is None:
+                r = p[1](p[0])
+                if type(r) is not tuple:
+                    p[2] = r  # ジェネレーター 次回から続きを読み込む
+                    r = None
             else:
-                # ビットマップ（フレームバッファを作成しない）
-                self.resources["images"].append(f.read(size))
-        f.close()
+                r = next(p[2])
+        except (MemoryError, StopIteration):
+            # 先読みはあきらめる
+            if p[2] is not None:
+                p[2].close()
+            del self.pending[0]
+            collect()
+            return len(self.pending) > 0
+
+        if r is not None:
+            # 読み込み完了
+            del self.pending[0]
+            self.store(p[0], r[0], r[1])
+
+        return len(self.pending) > 0
+
+    def load(self, name, loader):
+        """リソースを読み込んでキャッシュに登録"""
+        collect()
+        try:
+            data, size = self.run_loader(name, loader)
+        except MemoryError:
+            # 使われていないリソースを全て破棄してやり直し
+            self.evict(self.used)
+            data, size = self.run_loader(name, loader)
+
+        return self.store(name, data, size)
+
+    def run_loader(self, name, loader):
+        """ローダーを最後まで実行"""
+        r = loader(name)
+        if type(r) is tuple:
+            return r
+        # ジェネレーター
+        for v in r:
+            if v is not None:
+                return v
+
+    def store(self, name, data, size):
+        """キャッシュに登録"""
+        e = [data, size, 0]
+        self.entries[name] = e
+        self.lru.append(name)
+        self.used += size
+
+        # 予算を超えた分を破棄 登録したものは残す
+        self.evict(self.used - self.budget, name)
+        return e
+
+    def evict(self, size, keep=None):
+        """使われていないリソースを古い順に破棄
 
-    def release_resources(self):
-        """リソースの破棄"""
-        self.resources["images"].clear()
-        self.resources["misc"].clear()
+        Params:
+            size (int): 空けたいサイズ
+            keep (str): 破棄しないリソース名
+        """
+        i = 0
+        while size > 0 and i < len(self.lru):
+            name = self.lru[i]
+            e = self.entries[name]
+            if e[2] > 0 or name == keep:
+                i += 1  # 使用中
+                continue
+            del self.entries[name]
+            del self.lru[i]
+            self.used -= e[1]
+            size -= e[1]
         collect()
 
+    def clear(self):
+        """使われていないリソースを全て破棄"""
+        self.evict(self.used)
+
+
+resource_manager = ResourceManager()
+"""リソースのキャッシュ 全シーン共有"""
+
+sprite_pool = SpritePool()
+"""スプライトプール 全シーン共有"""
+
+
+class Profiler:
+    """区間毎の処理時間を計測（デバッグ用）
+    window フレーム毎に 最小・平均・最大 を更新
+    区間ごとに配列の要素が別なので 両コアから計測できる
+
+    Params:
+        window (int): 集計するフレーム数
+        scale (int): オーバーレイの 1px あたりの時間 us
+
+    Attributes:
+        enabled (bool): 計測するか
+        dump (bool): 集計毎にシリアルに出力するか
+        mins (array): 最小 us
+        avgs (array): 平均 us
+        maxs (array): 最大 us
+    """
+
+    def __init__(self, window=30, scale=140):
+        self.window = window
+        self.scale = scale
+        self.enabled = False
+        self.dump = False
+
+        self.starts = array("i", [0] * PROF_SLOTS)
+        self.sums = array("i", [0] * PROF_SLOTS)
+        self.counts = array("i", [0] * PROF_SLOTS)
+        self.cur_mins = array("i", [0] * PROF_SLOTS)
+        self.cur_maxs = array("i", [0] * PROF_SLOTS)
+        self.mins = array("i", [0] * PROF_SLOTS)
+        self.avgs = array("i", [0] * PROF_SLOTS)
+        self.maxs = array("i", [0] * PROF_SLOTS)
+
+    def reset(self):
+        """集計をクリア"""
+        for i in range(PROF_SLOTS):
+            self.sums[i] = self.counts[i] = 0
+            self.mins[i] = self.avgs[i] = self.maxs[i] = 0
+
+    def begin(self, slot):
+        """区間の開始"""
+        if self.enabled:
+            self.starts[slot] = ticks_us()
+
+    def end(self, slot):
+        """区間の終了"""
+        if self.enabled:
+            self.add(slot, ticks_diff(ticks_us(), self.starts[slot]))
+
+    def add(self, slot, us):
+        """計測値を追加"""
+        n = self.counts[slot]
+        if n == 0:
+            self.sums[slot] = 0
+            self.cur_mins[slot] = self.cur_maxs[slot] = us
+        elif us < self.cur_mins[slot]:
+            self.cur_mins[slot] = us
+        elif us > self.cur_maxs[slot]:
+            self.cur_maxs[slot] = us
+        self.sums[slot] += us
+
+        n += 1
+        if n < self.window:
+            self.counts[slot] = n
+            return
+
+        # 集計
+        self.counts[slot] = 0
+        self.mins[slot] = self.cur_mins[slot]
+        self.avgs[slot] = self.sums[slot] // n
+        self.maxs[slot] = self.cur_maxs[slot]
+        if self.dump and slot == PROF_FRAME:
+            self.report()
+
+    def draw(self, frame_buffer, x=0, y=LCD_H - PROF_SLOTS * 3):
+        """平均を棒グラフで描画 1区間 2px
+
+        Params:
+            frame_buffer (FrameBuffer): 描画対象のバッファ
+            x (int): X座標
+            y (int): Y座標
+        """
+        scale = self.scale
+        for i in range(PROF_SLOTS):
+            w = min(self.avgs[i] // scale, LCD_W - x)
+            frame_buffer.fill_rect(x + w, y, LCD_W - x - w, 2, 0)
+            frame_buffer.fill_rect(x, y, w, 2, prof_colors[i])
+            y += 3
+
+    def report(self):
+        """シリアルに出力"""
+        print("prof(us)  min  avg  max")
+        for i in range(PROF_SLOTS):
+            print(
+                "%-7s %5d %5d %5d"
+                % (prof_names[i], self.mins[i], self.avgs[i], self.maxs[i])
+            )
+
+
+profiler = Profiler()
+"""プロファイラ 全シーン共有"""
+
 
 class Animator:
     """アニメーション
@@ -876,22 +2180,40 @@ class Scene:
     def action(self):
         """実行"""
         t = ticks_ms()
-        if ticks_diff(t, self.fps_ticks) < self.fps_interval:  # FPS
+        elapsed = ticks_diff(t, self.fps_ticks)
+        if elapsed < self.fps_interval:  # FPS
             self.active = False
+            # フレームの空き時間にリソースを先読み・ステータス保存
+            if elapsed < self.fps_interval - PREFETCH_MARGIN:
+                director = self.director
+                if not resource_manager.step() and director is not None:
+                    if director.status is not None:
+                        director.status.update()
             return
 
         self.fps_ticks = t
         self.active = True
         self.frame_count += 1
 
+        prof = profiler
+        prof.begin(PROF_FRAME)
         # キースキャン
+        prof.begin(PROF_SCAN)
         self.key.scan()
+        prof.end(PROF_SCAN)
         # イベント処理
+        prof.begin(PROF_FIRE)
         self.event.fire()
+        prof.end(PROF_FIRE)
         # ステージ アクション
+        prof.begin(PROF_ACTION)
         self.stage.action()
+        prof.end(PROF_ACTION)
         # バッファ描画・LCD転送
+        prof.begin(PROF_SHOW)
         self.stage.show()
+        prof.end(PROF_SHOW)
+        prof.end(PROF_FRAME)
 
         # enter_frame イベントは毎フレーム発生
         self.event.post([EV_ENTER_FRAME, EV_PRIORITY_MID, 0, self, self.key])
@@ -921,11 +2243,13 @@ class Director:
         scene_stack (list): シーンのスタック
         is_Playing (bool): 実行中か
         values(list): シーン間で共有する変数
+        status (StatusStore): ステータス シーン切り替え時に保存
     """
 
     def __init__(self, scenes, key):
         self.scene_stack = []
         self.is_playing = False
+        self.status = None
 
         # シーンのリスト
         self.scenes = scenes
@@ -972,6 +2296,10 @@ class Director:
         if s is not None:
             s.leave()
 
+        # 未保存のステータスを書き込む
+        if self.status is not None:
+            self.status.flush()
+
     def get_current(self):
         """現在のシーン取得"""
         if not self.scene_stack:
@@ -3,26 +3,46 @@
     png画像からインデックスカラー作成
 
     usage:
-        png_to_dat.py [dir]
+        png_to_dat.py [dir] [-a] [-r]
 
         [dir] 画像ファイルのあるフォルダ
         フォルダ名.dat として出力します
+        [-a] 展開済み RGB565 アトラスを フォルダ名.atl として出力します
+        [-r] スプライトに不透明な範囲（行毎）を付けます 透過色の判定なしで描画できます
     
     in:
         png: 24bit-color
     out:
         [0] ファイル数
         ---------------------------
-        [1] タイプ 0:スプライト 1:ビットマップ
+        [1] タイプ 0:スプライト 1:ビットマップ 2:スプライト（不透明な範囲つき -r）
         [2] width
         [3] height
         [3] 読み込みサイズ
         [4..] 画像データ
                 スプライト: 2px = 1byte (4bit + 4bit)
                 ビットマップ: 1px = 2bytes (16bit color) little-endian
+        [..] 不透明な範囲（タイプ2のみ）
+                行毎に 範囲数, (開始X, 幅) * 範囲数 (各1byte)
         ---------------------------
         * 画像分繰り返し
 
+    out(-a):
+        [0] ファイル数
+        [1] アトラス width (2bytes)
+        [3] アトラス height (2bytes)
+        ---------------------------
+        [5] x, y, width, height (各2bytes)
+        ---------------------------
+        * 画像分繰り返し
+        [..] アトラス画像データ 1px = 2bytes (16bit color) little-endian
+                スプライトは縦横2倍に展開済み
+        ---------------------------
+        [..] 不透明な範囲のサイズ (2bytes) 0 なら無し (-r のみ)
+        [..] 行毎に 範囲数, (開始X, 幅) * 範囲数 (各1byte)
+        ---------------------------
+        * 画像分繰り返し (-r のみ)
+
 """
 
 from PIL import Image
@@ -57,6 +77,12 @@ palette888 = (
 # 透過色
 trans_index = 0
 
+# アトラスの幅
+ATLAS_W = 128
+
+# ゲーム側の透過色のインデックス (0x0726)
+ALPHA_INDEX = 11
+
 
 def main():
     args = sys.argv
@@ -70,6 +96,10 @@ def main():
     if len(img_list) == 0:
         return print("No image File!")
 
+    rle = "-r" in args[2:]
+    if "-a" in args[2:]:
+        return output_atlas(args[1], img_list, rle)
+
     print('""" フルカラー(RGB 24bit)PNG から ゲーム用バイナリデータ に変換 ver 1.00')
 
     file_count = 0
@@ -89,15 +119,20 @@ def main():
         # タイプ
         if "_sp_" in fn:
             # スプライト用
-            img_type = b"\x00"
+            image_bin = outputColorPixel(width, height, image)
+            if rle:
+                # 不透明な範囲つき
+                img_type = b"\x02"
+                image_bin += output_spans(image.convert("RGB"))
+            else:
+                img_type = b"\x00"
             f.write(img_type)
             # サイズ
             f.write(width.to_bytes(1, "big"))
             f.write(height.to_bytes(1, "big"))
-            size = (width // 2) * height
+            size = len(image_bin)
             f.write(size.to_bytes(2, "big"))
             # 画像の色配列情報のバイナリを取得して書き込む
-            image_bin = outputColorPixel(width, height, image)
             f.write(image_bin)
         else:
             img_type = b"\x01"
@@ -171,5 +206,98 @@ def outputColorPixel565(width, height, image):
     return result
 
 
+def output_atlas(name, img_list, rle=False):
+    """展開済み RGB565 アトラスを出力
+    スプライトは縦横2倍に展開する（ロード時の展開処理が不要になる）
+    """
+    print('""" フルカラー(RGB 24bit)PNG から 展開済みアトラス に変換 ver 1.00')
+
+    images = []
+    spans = []
+    for fn in img_list:
+        print("Loading... " + fn)
+        image = Image.open(fn)
+        if "_sp_" in fn:
+            images.append(expand_sprite(image))
+            spans.append(output_spans(images[-1]) if rle else b"")
+        else:
+            images.append(image.convert("RGB"))
+            spans.append(b"")
+
+    # 配置 高い順に棚に詰める
+    width = max(ATLAS_W, max(image.size[0] for image in images))
+    order = sorted(range(len(images)), key=lambda i: -images[i].size[1])
+    rects = [None] * len(images)
+    x = y = shelf_h = 0
+    for i in order:
+        w, h = images[i].size
+        if x + w > width:
+            # 次の棚
+            x = 0
+            y += shelf_h
+            shelf_h = 0
+        rects[i] = (x, y, w, h)
+        x += w
+        shelf_h = max(shelf_h, h)
+    height = y + shelf_h
+
+    # 透過色で埋める
+    col = palette888[11]
+    atlas = Image.new("RGB", (width, height), ((col >> 16) & 0xFF, (col >> 8) & 0xFF, col & 0xFF))
+    for image, rect in zip(images, rects):
+        atlas.paste(image, (rect[0], rect[1]))
+
+    f = open(SAVE_FILE_PATH + name + ".atl", "wb")
+    # ファイル数・サイズ
+    f.write(len(images).to_bytes(1, "big"))
+    f.write(width.to_bytes(2, "big"))
+    f.write(height.to_bytes(2, "big"))
+    # 矩形テーブル
+    for rect in rects:
+        for v in rect:
+            f.write(v.to_bytes(2, "big"))
+    # 画像データ
+    f.write(outputColorPixel565(width, height, atlas))
+    # 不透明な範囲
+    if rle:
+        for span in spans:
+            f.write(len(span).to_bytes(2, "big"))
+            f.write(span)
+    f.close()
+    print("Saved: " + SAVE_FILE_PATH + name + ".atl")
+
+
+# 行毎の不透明な範囲 範囲数, (開始X, 幅) * 範囲数
+def output_spans(image):
+    col = palette888[ALPHA_INDEX]
+    alpha = ((col >> 16) & 0xFF, (col >> 8) & 0xFF, col & 0xFF)
+    width, height = image.size
+
+    result = bytearray()
+    for y in range(height):
+        row = []
+        x = 0
+        while x < width:
+            if image.getpixel((x, y))[:3] == alpha:
+                x += 1
+                continue
+            start = x
+            while x < width and image.getpixel((x, y))[:3] != alpha:
+                x += 1
+            row.append((start, x - start))
+        result.append(len(row))
+        for start, w in row:
+            result.append(start)
+            result.append(w)
+
+    return result
+
+
+# スプライトを縦横2倍にする
+def expand_sprite(image):
+    width, height = image.size
+    return image.convert("RGB").resize((width * 2, height * 2), Image.NEAREST)
+
+
 if __name__ == "__main__":
     main()
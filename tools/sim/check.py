@@ -0,0 +1,339 @@
+# -*- coding:utf-8 -*-
+"""
+    シミュレーターで描画・入力の処理を確かめる
+    最適化した処理が 素直な処理と同じ結果になるか
+
+    check.py [-q]
+        -q: パネルの比較（1分ほどかかる）をしない
+    失敗があれば終了コード 1
+"""
+
+import sys
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+import sim
+
+results = []
+
+
+def check(name, ok, detail=""):
+    results.append(ok)
+    print("%s %s %s" % ("OK" if ok else "NG", name, detail))
+
+
+def fill_noise(buf, seed):
+    """バッファを乱数で埋める 描かなかった所も比べられるように"""
+    rnd = random.Random(seed)
+    buf[:] = rnd.randbytes(len(buf))
+
+
+def reference_view(g, fb, vx, vz, cos, sin, maps, rows):
+    """ビューを1ピクセルずつ描く（draw_view_v3 の基準）
+    各ピクセルのワールド座標がコース外ならコース外の色 それ以外はコースの色
+    """
+    pal_tbl = g["pal_tbl"]
+    fix = g["_FIX"]
+    pw = g["_PIXEL_W"]
+    ph = g["_PIXEL_H"]
+    for r in range(g["_VIEW_H"]):
+        if not (rows >> r) & 1:
+            continue
+        y = g["_SCREEN_Y"] + r * ph
+        fb.fill_rect(g["_SCREEN_X"], y, g["_SCREEN_W"], ph, g["_COL_BG"])
+        z = g["z_scale_tbl"][r]
+        h = g["h_scale_tbl"][r]
+        pal = pal_tbl[r]
+        level = g["mip_tbl"][r]
+        field = maps[level]
+        shift = g["_COURSE_RATIO"] + level
+        col_bits = g["_COURSE_DATA_COL"] - level
+        x = g["_SCREEN_X"]
+        for k in range(g["_VIEW_W_START"], g["_VIEW_W_END"]):
+            _y = k * g["_PX_FIX"] // h
+            wx = ((z * cos - _y * sin) >> fix) + vx
+            wz = ((z * sin + _y * cos) >> fix) + vz
+            if 0 <= wx < g["_COURSE_W"] and 0 <= wz < g["_COURSE_H"]:
+                c = pal[field[(wx >> shift) + ((wz >> shift) << col_bits)]]
+            else:
+                c = pal[g["_COL_INDEX_OUT"]]
+            fb.fill_rect(x, y, pw, ph, c)
+            x += pw
+
+
+def random_poses(g, n, seed):
+    """ビューの姿勢 コースの外・境界を含む"""
+    rnd = random.Random(seed)
+    w = g["_COURSE_W"]
+    h = g["_COURSE_H"]
+    for _ in range(n):
+        yield (
+            rnd.randrange(-200, w + 200),
+            rnd.randrange(-200, h + 200),
+            rnd.randrange(g["_H_RAD"] * 2),
+            rnd.choice((g["_ROWS_ALL"], rnd.randrange(1, g["_ROWS_ALL"] + 1))),
+        )
+
+
+def course(g, filename):
+    """コースデータ 等倍と縮小版"""
+    for d in g["load_course_map"](filename):
+        if d is not None:
+            return d[0]
+
+
+def check_view(s):
+    """ビューの描画 draw_view_v3 と 1ピクセルずつ描いた結果"""
+    from framebuf import FrameBuffer, RGB565
+
+    g = s.g
+    w = sim.PANEL_W
+    h = sim.PANEL_H
+    a = bytearray(w * h * 2)
+    b = bytearray(w * h * 2)
+    fa = FrameBuffer(a, w, h, RGB565)
+    fb = FrameBuffer(b, w, h, RGB565)
+    ng = 0
+    n = 0
+    for name, _, _, _ in g["course_datafile"]:
+        maps = course(g, name)
+        for i, (vx, vz, angle, rows) in enumerate(random_poses(g, 40, name)):
+            cos, sin = g["cos_sin"](angle)
+            fill_noise(a, i)
+            fill_noise(b, i)
+            cmd = (0, vx, vz, cos, sin, maps, fa, 0, g["_VIEW_H"], rows)
+            g["draw_view_v3"](cmd)
+            reference_view(g, fb, vx, vz, cos, sin, maps, rows)
+            n += 1
+            if a != b:
+                ng += 1
+    check("view", ng == 0, "%d/%d poses differ" % (ng, n))
+
+
+def check_band(s):
+    """コア0 の帯に描いて写したビューと 1回で描いたビュー"""
+    from framebuf import FrameBuffer, RGB565
+
+    g = s.g
+    lcd = g["lcd"]
+    split = g["_VIEW_SPLIT"]
+    band_buf = bytearray(sim.PANEL_W * g["_BAND_H"] * 2)
+    band = FrameBuffer(band_buf, sim.PANEL_W, g["_BAND_H"], RGB565)
+    maps = course(g, g["course_datafile"][0][0])
+    ng = 0
+    n = 0
+    for i, (vx, vz, angle, rows) in enumerate(random_poses(g, 60, 1)):
+        cos, sin = g["cos_sin"](angle)
+        args = (0, vx, vz, cos, sin, maps)
+        fill_noise(lcd.mv, i)
+        g["draw_view_v3"](args + (lcd, 0, g["_VIEW_H"], rows))
+        full = bytes(lcd.mv)
+        fill_noise(lcd.mv, i)
+        fill_noise(band_buf, i + 1)
+        g["draw_view_v3"](args + (lcd, split, g["_VIEW_H"], rows))
+        g["draw_view_v3"](args + (band, 0, split, rows), 0)
+        g["copy_band"](lcd, memoryview(band_buf), rows & ((1 << split) - 1))
+        n += 1
+        if bytes(lcd.mv) != full:
+            ng += 1
+    check("band", ng == 0, "%d/%d poses differ" % (ng, n))
+
+
+def check_atlas(s):
+    """展開済みアトラス main.atl と main.dat を展開した画像"""
+    import picogamelib
+
+    def load(name):
+        for d in picogamelib.load_images(name):
+            if d is not None:
+                return d[0]
+
+    atl = load("main.atl")
+    dat = load("main.dat")
+    ng = []
+    for i, (a, b) in enumerate(zip(atl, dat)):
+        if type(b) is bytes:
+            continue
+        if (a._w, a._h) != (b._w, b._h):
+            ng.append(i)
+            continue
+        if hasattr(b, "spans") and getattr(a, "spans", None) != b.spans:
+            ng.append(i)
+            continue
+        for y in range(b._h):
+            if any(a.pixel(x, y) != b.pixel(x, y) for x in range(b._w)):
+                ng.append(i)
+                break
+    ok = len(atl) == len(dat) and not ng
+    check("atlas", ok, "%d images, differ %s" % (len(dat), ng))
+
+
+def check_debounce(s):
+    """キーのチャタリング 押下は1回 離した時のチャタリングで押下・ダブルにならない"""
+    import machine
+    import picolcd114
+
+    clock = [10000000]
+    ticks_us = picolcd114.ticks_us
+    picolcd114.ticks_us = lambda: clock[0]
+    key = picolcd114.InputKey(use_register=False)
+    n = sim.PIN["L"]
+    k = picolcd114.KEY_LEFT
+
+    def edge(pressed, dt):
+        clock[0] += dt
+        machine.edge(n, pressed)
+
+    res = []
+    # 押下 押した時のチャタリング
+    key.scan()
+    edge(True, 1000)
+    edge(False, 200)
+    edge(True, 200)
+    key.scan()
+    res.append(key.push & k == k)
+    # 離す 離した時のチャタリング
+    clock[0] += 60000
+    edge(False, 0)
+    key.scan()
+    res.append(key.repeat & k == 0)
+    edge(True, 300)
+    edge(False, 300)
+    key.scan()
+    res.append(key.push & k == 0 and key.double & k == 0)
+    # フレーム間の短い押下のダブルタップ
+    double = []
+    for _ in range(2):
+        clock[0] += 80000
+        edge(True, 0)
+        edge(False, 200)
+        edge(True, 200)
+        edge(False, 40000)
+        edge(True, 300)
+        edge(False, 300)
+        key.scan()
+        double.append((key.push & k, key.double & k))
+        key.scan()
+    res.append(double == [(k, k), (k, 0)])
+    picolcd114.ticks_us = ticks_us
+    check("debounce", all(res), str(res))
+
+
+def check_action_order(s):
+    """Stage.action（描画リストで回す）と Sprite.action（再帰）の呼び出し順"""
+    import picogamelib as P
+
+    log = []
+
+    class Probe(P.Sprite):
+        def action(self):
+            log.append((self.name, self.parent.frame_index, self.parent.frame_wait))
+            super().action()
+
+    def build(seed):
+        rnd = random.Random(seed)
+        st = P.Stage("s")
+        st.scene = None
+        nodes = [st]
+        for i in range(40):
+            clz = Probe if rnd.random() < 0.3 else P.Sprite
+            sp = clz().init_params(0, "n%d" % i, 0, 0, rnd.randint(0, 3), 0, 0)
+            sp.frame_max = rnd.choice((0, 0, 2, 3))
+            sp.frame_wait = sp.frame_wait_def = rnd.randint(1, 3)
+            sp.active = rnd.random() < 0.9
+            rnd.choice(nodes).add_child(sp)
+            nodes.append(sp)
+        st.active = True
+        return st, nodes
+
+    def run(seed, action):
+        st, nodes = build(seed)
+        log.clear()
+        for _ in range(7):
+            action(st)
+        return list(log), [(sp.frame_index, sp.frame_wait) for sp in nodes[1:]]
+
+    ng = [i for i in range(200) if run(i, P.Stage.action) != run(i, P.Sprite.action)]
+    check("action order", not ng, "differ %s" % ng[:5])
+
+
+def check_thread_death(s):
+    """描画スレッドが例外で止まっても コア0 は固まらず 終了もすぐ戻る"""
+    import picolcd114
+
+    s.press(["B"])  # タイトルからレースへ
+    s.frames(30)
+    stage = s.scene().stage
+    alive = stage.thread_data[3]
+
+    def die(self, *args):
+        raise RuntimeError("render thread died")
+
+    show = picolcd114.LCD114.show
+    show_rect = picolcd114.LCD114.show_rect
+    picolcd114.LCD114.show = die
+    picolcd114.LCD114.show_rect = die
+    hook = sys.unraisablehook  # _thread のスレッドの例外
+    sys.unraisablehook = lambda args: None
+    time.sleep(0.2)
+    t = time.time()
+    s.frames(30)
+    frames_s = time.time() - t
+    t = time.time()
+    stage.stop_thread()
+    stop_s = time.time() - t
+    sys.unraisablehook = hook
+    picolcd114.LCD114.show = show
+    picolcd114.LCD114.show_rect = show_rect
+    dead = not stage.thread_data[3]
+    ok = alive and dead and frames_s < 3 and stop_s < 0.2
+    check("thread death", ok, "30 frames %.2fs stop %.3fs" % (frames_s, stop_s))
+
+
+def check_panels():
+    """LCD パネルの内容 省略・部分転送あり（RGB565 / インデックスカラー）と
+    毎フレーム全部描いて転送した基準
+    """
+    path = os.path.join(sim.HERE, "sim.py")
+    out = tempfile.mkdtemp(prefix="sim_out_")
+    for scenario in sim.SCENARIOS:
+        panels = []
+        for opts in ([], ["-i"], ["--full"]):
+            f = os.path.join(out, "%s%s.bin" % (scenario, "".join(opts)))
+            subprocess.run(
+                [sys.executable, path, scenario, "-o", f] + opts,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            panels.append(open(f, "rb").read())
+        n = len(panels[0]) // (sim.PANEL_W * sim.PANEL_H * 2)
+        ok = n > 0 and panels[0] == panels[1] == panels[2]
+        check("panel " + scenario, ok, "%d snapshots" % n)
+
+
+def main(argv):
+    if "-q" not in argv:
+        check_panels()
+    s = sim.Sim()
+    for f in (
+        check_view,
+        check_band,
+        check_atlas,
+        check_debounce,
+        check_action_order,
+        check_thread_death,
+    ):
+        try:
+            f(s)
+        except Exception as e:
+            check(f.__name__[6:], False, repr(e))
+    print("%d/%d OK" % (sum(results), len(results)))
+    sys.stdout.flush()
+    os._exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,325 @@
+# -*- coding:utf-8 -*-
+"""
+    ホストの CPython でゲームを動かすシミュレーター
+    stubs フォルダの framebuf, machine などの代わりを使う（実機では使わない）
+    LCD への転送はパネルのエミュレーターに書き込み 画面を比べられる
+
+    sim.py race|title [-i] [--full] [-o 出力ファイル]
+        race: コースを走る（加速・旋回・ポーズ・停止）
+        title: タイトル画面の操作からレースしてリザルト画面
+        -i: インデックスカラー（INDEXED_LCD = True）
+        --full: 描画の省略・部分転送をしない 毎フレーム画面全体（比べる基準）
+        -o: パネルのスナップショットをファイルに出力
+"""
+
+import sys
+import os
+import builtins
+import shutil
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+SRC = os.path.join(ROOT, "src")
+INSTALL = os.path.join(ROOT, "install")
+
+# キーのピン番号
+PIN = {"A": 15, "B": 17, "UP": 2, "C": 3, "L": 16, "D": 18, "R": 20}
+
+# 描画スレッドが追いつくまでの待ち 秒
+SETTLE = 0.4
+
+# LCD パネル
+PANEL_W = 240
+PANEL_H = 135
+
+
+def setup(indexed=False):
+    """スタブとソースをパスに追加 実行用の一時フォルダに移動
+
+    Params:
+        indexed (bool): インデックスカラー
+    Returns:
+        str: ソースのフォルダ
+    """
+    lib = tempfile.mkdtemp(prefix="sim_lib_")
+    for f in os.listdir(SRC):
+        if f.endswith(".py"):
+            shutil.copy(os.path.join(SRC, f), lib)
+    if indexed:
+        path = os.path.join(lib, "picogamelib.py")
+        src = open(path, encoding="utf-8").read()
+        old = "INDEXED_LCD = const(False)"
+        if old not in src:
+            raise RuntimeError("INDEXED_LCD not found")
+        src = src.replace(old, "INDEXED_LCD = const(True)")
+        open(path, "w", encoding="utf-8").write(src)
+
+    sys.path.insert(0, os.path.join(HERE, "stubs"))
+    sys.path.insert(1, lib)
+
+    # MicroPython の組み込み
+    builtins.const = lambda x: x
+    builtins.ptr8 = lambda b: memoryview(b).cast("B")
+    builtins.ptr16 = lambda b: memoryview(b).cast("B").cast("H")
+    builtins.ptr32 = lambda b: memoryview(b).cast("B").cast("I")
+
+    # リソース・セーブデータは一時フォルダで
+    wd = tempfile.mkdtemp(prefix="sim_wd_")
+    for f in os.listdir(INSTALL):
+        if not f.endswith(".py"):
+            shutil.copy(os.path.join(INSTALL, f), wd)
+    os.chdir(wd)
+    return lib
+
+
+class Panel:
+    """LCD パネルのエミュレーター
+    set_window の範囲に 送られたデータを行ごとに書き込む
+
+    Attributes:
+        buf (bytearray): パネルの内容 RGB565
+        bytes_sent (int): 送ったバイト数
+        windows (int): set_window の回数
+    """
+
+    def __init__(self):
+        self.buf = bytearray(PANEL_W * PANEL_H * 2)
+        self.win = [0, 0, PANEL_W, 0]  # x, y, w, 行内の位置
+        self.bytes_sent = 0
+        self.windows = 0
+
+    def set_window(self, x, y, w, h):
+        self.win[:] = [x, y, w, 0]
+        self.windows += 1
+
+    def write(self, data):
+        data = bytes(data)
+        self.bytes_sent += len(data)
+        win = self.win
+        n = win[2] * 2
+        while data:
+            o = (win[1] * PANEL_W + win[0]) * 2 + win[3]
+            k = min(len(data), n - win[3])
+            self.buf[o : o + k] = data[:k]
+            data = data[k:]
+            win[3] += k
+            if win[3] == n:
+                win[3] = 0
+                win[1] += 1
+
+    def install(self, lcd):
+        """LCD の転送先をこのパネルにする"""
+        import picolcd114
+
+        panel = self
+        picolcd114.LCD114.set_window = lambda self, x, y, w, h: panel.set_window(
+            x, y, w, h
+        )
+        lcd.spi.write = self.write
+
+
+class Sim:
+    """main.py を読み込んで フレームを進める
+
+    Params:
+        indexed (bool): インデックスカラー
+        full (bool): 描画の省略・部分転送をしない
+
+    Attributes:
+        g (dict): main.py のグローバル
+        director (Director): ディレクター
+        panel (Panel): LCD パネル
+        render_stats (array): レース中の描画スレッドの統計
+    """
+
+    def __init__(self, indexed=False, full=False):
+        lib = setup(indexed)
+        path = os.path.join(lib, "main.py")
+        src = open(path, encoding="utf-8").read()
+        src = src.replace("\ndirector.play()", "\n")
+        self.g = {"__name__": "sim_main"}
+        exec(compile(src, path, "exec"), self.g)
+        self.director = self.g["director"]
+        self.panel = Panel()
+        self.panel.install(self.g["lcd"])
+        self.render_stats = None  # レース中の描画スレッドの統計
+        if full:
+            self.brute_force()
+
+    def brute_force(self):
+        """描画の省略・部分転送を止める 毎フレーム全部描いて画面全体を転送"""
+        import picogamelib
+        import picolcd114
+
+        g = self.g
+        g["same_queue"] = lambda a, b: False
+        picolcd114.LCD114.show_rect = lambda self, x, y, w, h: self.show()
+
+        stage_show = picogamelib.Stage.show
+
+        def show(self):
+            self.dirty = True
+            stage_show(self)
+
+        picogamelib.Stage.show = show
+
+        thread_show = g["ThreadStage"].show
+
+        def show_all(self):
+            self.view_pose = None  # ビューは全行描き直す
+            thread_show(self)
+
+        g["ThreadStage"].show = show_all
+
+        publish = g["ThreadStage"].publish
+        g["ThreadStage"].publish = lambda self, queue, index, rects: publish(
+            self, queue, index, None
+        )
+
+    def frames(self, n):
+        """n フレーム進める（1フレームは6回の action）"""
+        import utime
+
+        d = self.director
+        for _ in range(n):
+            for _ in range(6):
+                utime.advance(6)
+                d.get_current().action()
+            time.sleep(0.002)
+
+    def press(self, names, n=1):
+        """キーを押したまま n フレーム進めて離す
+
+        Params:
+            names (list): キーの名前 PIN のキー
+            n (int): フレーム数
+        """
+        import machine
+
+        for name in names:
+            machine.edge(PIN[name], True)
+        self.frames(n)
+        for name in names:
+            machine.edge(PIN[name], False)
+
+    def snap(self):
+        """描画スレッドが追いつくのを待ってパネルの内容"""
+        time.sleep(SETTLE)
+        return bytes(self.panel.buf)
+
+    def scene(self):
+        return self.director.get_current()
+
+
+def race(sim):
+    """コースを走る 加速・旋回 パワーが尽きてリザルト ポーズ中のキーでタイトルへ
+
+    Returns:
+        list: (シーン名, パネル)
+    """
+    snaps = []
+
+    def snap():
+        snaps.append((sim.scene().name, sim.snap()))
+
+    sim.frames(40)  # タイトルのアニメーション
+    sim.press(["R"])
+    sim.frames(3)
+    sim.press(["B"])
+    sim.frames(72)  # レディ
+    sim.press(["B"], 120)
+    sim.press(["B", "L"], 30)
+    sim.render_stats = sim.scene().stage.render_stats
+    snap()
+    for _ in range(8):
+        sim.press(["B"], 3)
+        snap()
+    sim.press(["B", "R"], 25)
+    snap()
+    sim.press(["A"])
+    sim.frames(12)
+    snap()
+    sim.frames(30)
+    snap()
+    sim.press(["B"])
+    sim.frames(7)
+    snap()
+    sim.frames(20)
+    snap()
+    sim.frames(30)
+    snap()
+    return snaps
+
+
+def title(sim):
+    """タイトル画面の操作 レースしてリザルト画面
+
+    Returns:
+        list: (シーン名, パネル)
+    """
+    snaps = []
+
+    def snap():
+        snaps.append((sim.scene().name, sim.snap()))
+
+    sim.frames(20)
+    snap()
+    sim.frames(40)
+    snap()
+    for _ in range(3):
+        sim.press(["R"])
+        sim.frames(5)
+        snap()
+    for _ in range(2):
+        sim.press(["A"])
+        sim.frames(5)
+        snap()
+    sim.press(["L"])
+    sim.press(["L"])
+    sim.frames(30)
+    snap()
+    sim.frames(60)
+    snap()
+    # レースしてリザルトへ
+    sim.press(["B"])
+    sim.frames(62)
+    sim.press(["B"], 100)
+    sim.press(["B", "R"], 20)
+    for _ in range(60):
+        sim.frames(10)
+        if sim.scene().name == "main" and sim.render_stats is None:
+            sim.render_stats = sim.scene().stage.render_stats
+        if sim.scene().name == "results":
+            break
+    for _ in range(8):
+        sim.frames(10)
+        snap()
+    return snaps
+
+
+SCENARIOS = {"race": race, "title": title}
+
+
+def main(argv):
+    name = argv[0]
+    out = argv[argv.index("-o") + 1] if "-o" in argv else None
+    sim = Sim(indexed="-i" in argv, full="--full" in argv)
+    t = time.time()
+    snaps = SCENARIOS[name](sim)
+    print("%s: %d snapshots %.1fs" % (name, len(snaps), time.time() - t))
+    print(" ".join(tag for tag, buf in snaps))
+    print("bytes sent %d windows %d" % (sim.panel.bytes_sent, sim.panel.windows))
+    if sim.render_stats is not None:
+        sim.g["report_render_stats"](sim.render_stats)
+    if out is not None:
+        with open(out, "wb") as f:
+            for tag, buf in snaps:
+                f.write(buf)
+    sys.stdout.flush()
+    os._exit(0)  # 描画スレッドは止めずに終了
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+"""
+    framebuf の代わり（ホストのシミュレーター用）
+    ピクセルを Python で書き換えるので遅いが 結果は MicroPython と同じ
+    バッファの大きさの確認 blit のパレット・透過色の順番も合わせている
+    ellipse, poly は描画しない
+"""
+
+MONO_VLSB = 0
+RGB565 = 1
+GS4_HMSB = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+GS2_HMSB = 5
+GS8 = 6
+
+# 1ピクセルのビット数
+_BITS = {RGB565: 16, GS8: 8, GS4_HMSB: 4, GS2_HMSB: 2, MONO_HLSB: 1}
+
+
+class FrameBuffer:
+    """MicroPython と同じく 描画メソッドの中からはサブクラスのメソッドを呼ばない"""
+
+    def __init__(self, buf, width, height, format, stride=None):
+        self._buf = memoryview(buf).cast("B")
+        self._w = width
+        self._h = height
+        self._fmt = format
+        self._stride = width if stride is None else stride
+        self._bits = _BITS[format]
+        if len(self._buf) * 8 < self._stride * height * self._bits:
+            raise ValueError("buffer too small")
+
+    def _get(self, x, y):
+        buf = self._buf
+        i = y * self._stride + x
+        bits = self._bits
+        if bits == 16:
+            return buf[i * 2] | (buf[i * 2 + 1] << 8)
+        if bits == 8:
+            return buf[i]
+        if bits == 4:
+            return (buf[i >> 1] >> ((i & 1) * 4)) & 0x0F
+        if bits == 2:
+            return (buf[i >> 2] >> ((i & 3) * 2)) & 0x03
+        return (buf[i >> 3] >> (7 - (i & 7))) & 1
+
+    def _set(self, x, y, c):
+        buf = self._buf
+        i = y * self._stride + x
+        bits = self._bits
+        if bits == 16:
+            buf[i * 2] = c & 0xFF
+            buf[i * 2 + 1] = (c >> 8) & 0xFF
+        elif bits == 8:
+            buf[i] = c & 0xFF
+        elif bits == 4:
+            s = (i & 1) * 4
+            buf[i >> 1] = (buf[i >> 1] & ~(0x0F << s) & 0xFF) | ((c & 0x0F) << s)
+        elif bits == 2:
+            s = (i & 3) * 2
+            buf[i >> 2] = (buf[i >> 2] & ~(0x03 << s) & 0xFF) | ((c & 0x03) << s)
+        else:
+            s = 7 - (i & 7)
+            buf[i >> 3] = (buf[i >> 3] & ~(1 << s) & 0xFF) | ((c & 1) << s)
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self._w and 0 <= y < self._h):
+            return None
+        if c is None:
+            return self._get(x, y)
+        self._set(x, y, c)
+
+    def fill_rect(self, x, y, w, h, c):
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + w, self._w)
+        y1 = min(y + h, self._h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if self._bits >= 8:
+            # 1行ずつまとめて書き込む
+            b = self._bits // 8
+            row = (c & (1 << self._bits) - 1).to_bytes(b, "little") * (x1 - x0)
+            for yy in range(y0, y1):
+                i = (yy * self._stride + x0) * b
+                self._buf[i : i + len(row)] = row
+            return
+        for yy in range(y0, y1):
+            for xx in range(x0, x1):
+                self._set(xx, yy, c)
+
+    def fill(self, c):
+        FrameBuffer.fill_rect(self, 0, 0, self._w, self._h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        fill_rect = FrameBuffer.fill_rect
+        if f:
+            fill_rect(self, x, y, w, h, c)
+        else:
+            fill_rect(self, x, y, w, 1, c)
+            fill_rect(self, x, y + h - 1, w, 1, c)
+            fill_rect(self, x, y, 1, h, c)
+            fill_rect(self, x + w - 1, y, 1, h, c)
+
+    def hline(self, x, y, w, c):
+        FrameBuffer.fill_rect(self, x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        FrameBuffer.fill_rect(self, x, y, 1, h, c)
+
+    def line(self, x0, y0, x1, y1, c):
+        # ブレゼンハム
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        e = dx + dy
+        while True:
+            FrameBuffer.pixel(self, x0, y0, c)
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * e
+            if e2 >= dy:
+                e += dy
+                x0 += sx
+            if e2 <= dx:
+                e += dx
+                y0 += sy
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        # パレットで変換してから透過色と比べる（MicroPython と同じ順番）
+        for yy in range(max(0, -y), min(fbuf._h, self._h - y)):
+            for xx in range(max(0, -x), min(fbuf._w, self._w - x)):
+                c = fbuf._get(xx, yy)
+                if palette is not None:
+                    c = palette._get(c, 0)
+                if c != key:
+                    self._set(x + xx, y + yy, c)
+
+    def scroll(self, xstep, ystep):
+        pass
+
+    def text(self, s, x, y, c=1):
+        pass
+
+    def ellipse(self, x, y, xr, yr, c, f=False, m=15):
+        pass
+
+    def poly(self, x, y, coords, c, f=False):
+        pass
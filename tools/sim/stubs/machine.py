@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+"""
+    machine の代わり（ホストのシミュレーター用）
+    キーは PRESSED にピン番号を入れると押下 edge() で割り込みを起こす
+"""
+
+PRESSED = set()  # 押されているピン番号
+pins = {}  # ピン番号 -> Pin（割り込みを設定したもの）
+
+
+class Irq:
+    def __init__(self):
+        self.last_flags = 0
+
+    def flags(self):
+        return self.last_flags
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, n, mode=None, pull=None):
+        self.n = n
+        self.handler = None
+        self.trigger = 0
+        self._irq = Irq()
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def value(self, v=None):
+        if v is None:
+            return 0 if self.n in PRESSED else 1
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        if handler is not None:
+            self.handler = handler
+            self.trigger = trigger
+            pins[self.n] = self
+        return self._irq
+
+
+def edge(n, pressed):
+    """ピンの状態を変えて 設定されていれば割り込みハンドラを呼ぶ"""
+    if pressed:
+        PRESSED.add(n)
+    else:
+        PRESSED.discard(n)
+    pin = pins.get(n)
+    if pin is None:
+        return
+    flags = Pin.IRQ_FALLING if pressed else Pin.IRQ_RISING
+    pin._irq.last_flags = flags
+    if pin.trigger & flags:
+        pin.handler(pin)
+
+
+class SPI:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def write(self, buf):
+        pass
+
+
+class PWM:
+    def __init__(self, pin):
+        pass
+
+    def freq(self, f):
+        pass
+
+    def duty_u16(self, v):
+        pass
+
+
+def freq(f=None):
+    return 125000000
+
+
+class _Mem:
+    """GPIO 入力レジスタ 押されているピンは 0"""
+
+    def __getitem__(self, addr):
+        v = 0xFFFFFFFF
+        for n in PRESSED:
+            v &= ~(1 << n)
+        return v
+
+
+mem32 = _Mem()
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state):
+    pass
@@ -0,0 +1,21 @@
+# -*- coding:utf-8 -*-
+"""
+    micropython の代わり（ホストのシミュレーター用）
+    viper の ptr8, ptr16 はシミュレーターが builtins に用意する
+"""
+
+
+def const(x):
+    return x
+
+
+def native(f):
+    return f
+
+
+def viper(f):
+    return f
+
+
+def schedule(f, arg):
+    f(arg)
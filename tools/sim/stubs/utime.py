@@ -0,0 +1,35 @@
+# -*- coding:utf-8 -*-
+"""
+    utime の代わり（ホストのシミュレーター用）
+    ticks_ms はシミュレーターが advance() で進める（フレームの進み方を一定にする）
+    ticks_us は実時間（処理時間・コア間の待ちの上限）
+"""
+
+import time
+
+_ms = [0]
+
+
+def ticks_ms():
+    return _ms[0]
+
+
+def ticks_us():
+    return int(time.perf_counter() * 1000000) & 0x3FFFFFFF
+
+
+def ticks_diff(a, b):
+    return a - b
+
+
+def ticks_add(a, b):
+    return a + b
+
+
+def sleep_ms(ms):
+    pass
+
+
+def advance(ms):
+    """ticks_ms を進める"""
+    _ms[0] += ms